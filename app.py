@@ -1,12 +1,25 @@
-import threading
+from __future__ import annotations
+
+import os
 import tkinter as tk
-import traceback
 from tkinter import messagebox
+from typing import TYPE_CHECKING
 
-from core import *
 from gui import Window
-from plot import render_synthesis
+from jobs import Cancelled, Job, JobError, JobQueue
+
+if TYPE_CHECKING:
+    from core import Account, Portfolio
+
 
+def import_plot():
+    # numpy and matplotlib take most of the startup time, they are only
+    # loaded by the first job or by the background prewarm
+    import matplotlib
+    matplotlib.use("agg")
+
+    import plot
+    return plot
 
 
 class App:
@@ -14,96 +27,177 @@ class App:
     current_account: Account | None
     export_account: Account | None
 
-    thread: threading.Thread | None
+    jobs: JobQueue
 
     window: Window
 
-    def __init__(self) -> None:
+    def __init__(self, prewarm=True) -> None:
         self.import_account = None
         self.current_account = None
         self.export_account = None
 
-        self.thread = None
+        self.window = Window(self.on_merge, self.on_synthetize,
+                             self.on_consolidate, self.on_cancel, self.on_quit)
+        self.jobs = JobQueue(self.window.root,
+                             on_progress=self.on_progress,
+                             on_idle=self.on_idle)
+
+        if prewarm:
+            self.window.root.after_idle(self.on_prewarm)
 
-        self.window = Window(self.on_merge, self.on_synthetize, self.on_quit)
+    def on_prewarm(self):
+        self.jobs.submit("prewarm", lambda job: import_plot())
 
     def on_merge(self):
+        import_filename = self.window.import_picker.filename()
+        current_filename = self.window.current_picker.filename()
         backup = self.window.config_bar.backup_check.is_checked()
-        self._do_merge(backup)
+
+        self.jobs.submit("merge",
+                         lambda job: self._do_merge(
+                             job, import_filename, current_filename, backup),
+                         on_done=lambda accounts: self._on_merged(
+                             accounts, current_filename),
+                         on_error=self._on_error)
+        self.window.action_bar.button_cancel["state"] = tk.NORMAL
 
     def on_synthetize(self):
         current_filename = self.window.current_picker.filename()
-        current_file = read_csv_file(current_filename)
-        self.export_account = Account.parse_current(current_file)
-
         only_last_month = self.window.config_bar.last_month_check.is_checked()
-        self.window.action_bar.button_synthetize["state"] = tk.DISABLED
-        self.window.action_bar.button_merge["state"] = tk.DISABLED
+        workers = self.window.config_bar.workers_spin.value()
+
+        self.jobs.submit("synthesis",
+                         lambda job: self._do_synthetize(
+                             job, current_filename, only_last_month, workers),
+                         on_done=self._on_synthetized,
+                         on_error=self._on_error)
+        self.window.action_bar.button_cancel["state"] = tk.NORMAL
+
+    def on_consolidate(self):
+        current_filenames = self.window.select_current_files()
+        if len(current_filenames) == 0:
+            return
+        only_last_month = self.window.config_bar.last_month_check.is_checked()
+        workers = self.window.config_bar.workers_spin.value()
+
+        self.jobs.submit("consolidation",
+                         lambda job: self._do_consolidate(
+                             job, current_filenames, only_last_month, workers),
+                         on_done=self._on_consolidated,
+                         on_error=self._on_error)
+        self.window.action_bar.button_cancel["state"] = tk.NORMAL
 
-        if self.thread is not None:
-            self.thread.join()
+    def on_cancel(self):
+        self.jobs.cancel()
 
-        self.thread = threading.Thread(
-            target=self._do_synthetize, args=(only_last_month,))
-        self.thread.start()
+    def on_progress(self, job: Job, done, total):
+        self.window.progress_bar.configure(value=100 * done / total)
+
+    def on_idle(self):
+        self.window.action_bar.button_cancel["state"] = tk.DISABLED
 
     def on_quit(self):
+        self.jobs.cancel()
         self.window.root.destroy()
 
-    def _do_synthetize(self, only_last_month: bool):
-        end_date = self.export_account.ended_at()
-        start_date = self.export_account.started_at()
-        dates = make_linear_date(start_date, end_date)
-        month_scale = make_accounting_term_dates(start_date, end_date)
-        self.window.progress_bar.step(amount=-100)
-
-        progress = 100 if only_last_month else 1/len(month_scale)*100
-        render_synthesis(self.export_account, dates, period=30)
-        self.window.progress_bar.step(amount=progress)
+    def _do_synthetize(self, job: Job, current_filename, only_last_month: bool, workers: int = 1):
+        job.report(0, 1)
+        plot = import_plot()
+        from core import Account
 
-        all_periods = list(zip(month_scale, month_scale[1:]))
-        periods = [all_periods[-1]] if only_last_month else all_periods
-        for start, end in periods:
-            dates = make_linear_date(start, end)
-            render_synthesis(self.export_account, dates)
-            self.window.progress_bar.step(amount=progress)
+        try:
+            export_account = Account.read_current(current_filename)
+        except Exception as e:
+            raise JobError("Unable to read files", e) from e
 
-        messagebox.showinfo(
-            "Done", f"Successfully generated synthesis reports from {start_date.isoformat()} to {end_date.isoformat()}")
+        name = os.path.splitext(os.path.basename(current_filename))[0]
+        plot.synthetize(export_account, only_last_month, workers,
+                        on_progress=job.report, name=name)
+        return export_account
 
-        self.window.action_bar.button_synthetize["state"] = tk.NORMAL
-        self.window.action_bar.button_merge["state"] = tk.NORMAL
+    def _do_consolidate(self, job: Job, current_filenames, only_last_month: bool, workers: int = 1):
+        job.report(0, 1)
+        plot = import_plot()
+        from core import Portfolio
 
-    def _do_merge(self, backup: bool):
         try:
-            import_filename = self.window.import_picker.filename()
-            import_file = read_xls_file(import_filename)
-            self.import_account = Account.parse_import(import_file)
+            portfolio = Portfolio.read_current(current_filenames)
+        except Exception as e:
+            raise JobError("Unable to read files", e) from e
+
+        directory = os.path.dirname(os.path.abspath(current_filenames[0]))
+        plot.synthetize_portfolio(portfolio, only_last_month, workers,
+                                  directory=directory, on_progress=job.report)
+        return portfolio
 
-            current_filename = self.window.current_picker.filename()
-            current_file = read_csv_file(current_filename)
-            self.current_account = Account.parse_current(current_file)
+    def _do_merge(self, job: Job, import_filename, current_filename, backup: bool):
+        job.report(0, 4)
+        from core import Account, Journal
+        from duplicates import DuplicateMatcher
+        from rules import Categorizer
 
+        try:
+            rules = Categorizer.find(os.path.dirname(os.path.abspath(current_filename)))
+            import_account = Account.read_import(import_filename, rules)
+            job.report(1, 4)
+            current_account = Account.read_current(current_filename)
+            job.report(2, 4)
+        except Cancelled:
+            raise
         except Exception as e:
-            traceback.print_exception(e)
-            messagebox.showerror("Unable to read files", f"{e}")
-            return
+            raise JobError("Unable to read files", e) from e
+
+        matcher = DuplicateMatcher()
+        export_account = current_account.merge(import_account, matcher)
+        job.report(3, 4)
 
+        job.check()
         try:
             if backup:
-                backup_filename = current_filename + ".backup"
-                current_rows = self.current_account.to_export()
-                write_csv_file(backup_filename, current_rows)
+                Journal(current_filename).snapshot(current_filename + ".backup")
 
-            self.export_account = self.current_account.merge(
-                self.import_account)
-            export_rows = self.export_account.to_export()
-
-            write_csv_file(current_filename, export_rows)
+            export_account.append_current(current_filename, current_account)
+            matcher.write(current_filename, import_account.imported_at)
         except Exception as e:
-            traceback.print_exception(e)
-            messagebox.showerror("Unable to write files", f"{e}")
-            return
+            raise JobError("Unable to write files", e) from e
+
+        return (import_account, current_account, export_account, matcher)
+
+    def _on_merged(self, accounts, current_filename):
+        self.window.progress_bar.configure(value=100)
+        (self.import_account, self.current_account, self.export_account, matcher) = accounts
 
-        msg = f"Successfully merged {len(self.import_account.transactions)} transactions !"
+        from core import Journal
+
+        # The journal only makes the merge write cheap and atomic, it is
+        # folded into the current record right away
+        journal = Journal(current_filename)
+        self.jobs.submit("compaction", lambda job: journal.compact(),
+                         on_error=self._on_error)
+        self.window.action_bar.button_cancel["state"] = tk.NORMAL
+
+        msg = f"Successfully merged {len(self.import_account.table)} transactions !"
+        if len(matcher.matches) > 0:
+            from duplicates import duplicates_filepath
+            msg += f"\n{len(matcher.matches)} reformatted duplicates were merged, " \
+                f"see {os.path.basename(duplicates_filepath(current_filename))}"
         messagebox.showinfo("Done", msg)
+
+    def _on_synthetized(self, export_account: Account):
+        self.export_account = export_account
+        start_date = export_account.started_at()
+        end_date = export_account.ended_at()
+        messagebox.showinfo(
+            "Done", f"Successfully generated synthesis reports from {start_date.isoformat()} to {end_date.isoformat()}")
+
+    def _on_consolidated(self, portfolio: Portfolio):
+        start_date = portfolio.started_at()
+        end_date = portfolio.ended_at()
+        messagebox.showinfo(
+            "Done", f"Successfully generated portfolio reports of {len(portfolio.accounts)} accounts from {start_date.isoformat()} to {end_date.isoformat()}")
+
+    def _on_error(self, e: Exception):
+        if isinstance(e, JobError):
+            messagebox.showerror(e.title, f"{e.error}")
+        else:
+            messagebox.showerror("Unexpected error", f"{e}")
@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+
+from core import *
+from duplicates import DuplicateMatcher
+from rules import Categorizer, Rule
+
+BENCH_BASELINE_FILENAME = "bench_baseline.json"
+BENCH_SIZES = [1_000, 10_000, 100_000]
+
+CATEGORIES = {
+    "Alimentation": (("Courses", -120.0, -5.0), ("Restaurant", -60.0, -8.0), ("Cafe", -5.0, -1.5)),
+    "Logement": (("Loyer", -1200.0, -600.0), ("Energie", -150.0, -30.0), ("Assurance", -40.0, -10.0)),
+    "Transport": (("Carburant", -90.0, -20.0), ("Train", -120.0, -10.0), ("Parking", -25.0, -2.0)),
+    "Loisirs": (("Sport", -60.0, -10.0), ("Culture", -40.0, -5.0), ("Voyage", -900.0, -80.0)),
+    "Sante": (("Pharmacie", -40.0, -3.0), ("Medecin", -60.0, -25.0)),
+    "Revenus": (("Salaire", 1800.0, 3200.0), ("Remboursement", 5.0, 200.0)),
+    "Virements": (("Epargne", -500.0, -50.0), ("Interne", -300.0, 300.0)),
+}
+LABELS_PER_SUB_CATEGORY = 40
+
+
+def generate_transactions(size, seed=0, duplicate_rate=0.02, per_day=3.0, started_at=datetime.date(2000, 1, 1)):
+    rng = random.Random(seed)
+    sub_categories = [(category, *sub_category)
+                      for category, subs in CATEGORIES.items() for sub_category in subs]
+
+    occured_at = started_at
+    transactions = []
+    while len(transactions) < size:
+        if transactions and rng.random() < duplicate_rate:
+            t = transactions[-1]
+            transactions.append(Transaction(occured_at, t.category, t.sub_category,
+                                            t.label, t.amount))
+            continue
+        if transactions and rng.random() < 1 / per_day:
+            occured_at += DAY_DELTA
+
+        (category, sub_category, low, high) = rng.choice(sub_categories)
+        label = f"{sub_category.upper()} {rng.randrange(LABELS_PER_SUB_CATEGORY):02d}"
+        amount = round(rng.uniform(low, high), 2)
+        transactions.append(
+            Transaction(occured_at, category, sub_category, label, amount))
+
+    return transactions
+
+
+def make_current_rows(transactions, imported_at, initial_balance=1000.0):
+    account = Account(initial_balance, imported_at, transactions)
+    return account.to_export()
+
+
+def make_import_rows(transactions, final_balance, imported_at):
+    header = ["", f"Solde au {make_french_date(imported_at, '/')}",
+              final_balance]
+    rows = [[make_french_date(t.occured_at), t.category, t.sub_category, t.label, t.amount]
+            for t in reversed(transactions)]
+    return [header, [], ["Date", "Categorie", "Sous categorie", "Libelle", "Montant"], *rows]
+
+
+def generate_ledger(size, seed=0, duplicate_rate=0.02, import_days=90):
+    transactions = generate_transactions(size, seed, duplicate_rate)
+    ended_at = transactions[-1].occured_at
+    imported_at = ended_at + DAY_DELTA
+    current_rows = make_current_rows(transactions, imported_at)
+
+    exported_at = imported_at + datetime.timedelta(days=30)
+    new_transactions = [t for t in generate_transactions(max(size // 100, 10), seed + 1,
+                                                         duplicate_rate, started_at=imported_at)
+                        if t.occured_at < exported_at]
+    overlap = [t for t in transactions
+               if (ended_at - t.occured_at).days < import_days]
+    imported = overlap + new_transactions
+    final_balance = round(1000.0 + sum(t.amount for t in transactions) +
+                          sum(t.amount for t in new_transactions), 2)
+    import_rows = make_import_rows(imported, final_balance, exported_at)
+    return (current_rows, import_rows)
+
+
+def measure(stage, repeat=1):
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    for _ in range(repeat):
+        result = stage()
+    wall = (time.perf_counter() - start) / repeat
+    cpu = (time.process_time() - cpu_start) / repeat
+
+    tracemalloc.start()
+    stage()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return (result, {"wall": wall, "cpu": cpu, "peak_memory": peak})
+
+
+def run_benchmark(size, seed=0, render=True):
+    from plot import render_synthesis
+
+    (current_rows, import_rows) = generate_ledger(size, seed)
+    results = {}
+
+    (current, results["parse_current"]) = measure(
+        lambda: Account.parse_current(current_rows))
+    (imported, results["parse_import"]) = measure(
+        lambda: Account.parse_import(import_rows))
+    (_, results["merge"]) = measure(lambda: current.merge(imported))
+    (_, results["fuzzy_merge"]) = measure(
+        lambda: current.merge(imported, DuplicateMatcher()))
+
+    dates = make_linear_date(current.started_at(), current.ended_at())
+    (_, results["balance"]) = measure(
+        lambda: (current.balance(), current.gain(), current.loss()))
+    (_, results["sampling"]) = measure(
+        lambda: (sample(dates, current.balance()),
+                 aggregate(dates, current.gain()),
+                 aggregate(dates, current.loss())))
+    (_, results["category_grouping"]) = measure(
+        lambda: CategoryIndex(current.table).by_sub_category())
+    rules = [Rule("contains", f"{sub_category.upper()} {idx:02d}", None, None,
+                  category, f"{sub_category} {idx % 4}")
+             for category, subs in CATEGORIES.items()
+             for sub_category, *_ in subs
+             for idx in range(LABELS_PER_SUB_CATEGORY)]
+    (_, results["categorize"]) = measure(
+        lambda: Categorizer(rules).categorize(imported.table))
+
+    def rollup():
+        rollup = PeriodRollup.from_account(current)
+        return [rollup.level(granularity)
+                for granularity in ("week", "month", "quarter", "year")]
+    (_, results["period_rollup"]) = measure(rollup)
+
+    if render:
+        month_scale = make_accounting_term_dates(
+            current.started_at(), current.ended_at())
+        month_dates = make_linear_date(month_scale[-2], month_scale[-1])
+        with tempfile.TemporaryDirectory() as directory:
+            (_, results["render_month"]) = measure(
+                lambda: render_synthesis(current, month_dates, directory=directory))
+
+    return results
+
+
+def compare(results, baseline):
+    lines = []
+    for size, stages in results.items():
+        for stage, metrics in stages.items():
+            try:
+                reference = baseline[size][stage]["wall"]
+            except KeyError:
+                continue
+            ratio = metrics["wall"] / reference if reference > 0 else float("inf")
+            lines.append(f"{size:>9} {stage:<18} {metrics['wall']*1e3:>10.2f} ms "
+                         f"{reference*1e3:>10.2f} ms {ratio:>6.2f}x")
+    return lines
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark parsing, merging, sampling, grouping and rendering on synthetic ledgers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=BENCH_SIZES,
+                        help="number of transactions of each synthetic ledger, up to 1000000")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-render", action="store_true",
+                        help="skip the single-report rendering stage")
+    parser.add_argument("--baseline", default=BENCH_BASELINE_FILENAME,
+                        help="baseline file to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store these results as the new baseline")
+    parser.add_argument("--output", default=None,
+                        help="write the JSON results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    matplotlib.use("agg")
+
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = run_benchmark(size, args.seed,
+                                           render=not args.no_render)
+        for stage, metrics in results[str(size)].items():
+            print(f"{size:>9} {stage:<18} {metrics['wall']*1e3:>10.2f} ms "
+                  f"{metrics['peak_memory'] / 2**20:>8.1f} MiB", file=sys.stderr)
+
+    if args.output is not None:
+        with open(args.output, mode="w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, mode="w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        print("\n".join(compare(results, baseline)))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import timing
+from core import *
+from duplicates import FUZZY_THRESHOLD, DuplicateMatcher
+from plot import init_worker, synthetize, synthetize_portfolio
+from rules import Categorizer
+
+
+def merge_account(import_filename, current_filename, backup=False, rules_filename=None, fuzzy_threshold=FUZZY_THRESHOLD):
+    timings = {}
+
+    start = time.perf_counter()
+    if rules_filename is not None:
+        rules = Categorizer.read(rules_filename)
+    else:
+        rules = Categorizer.find(os.path.dirname(os.path.abspath(current_filename)))
+    import_account = Account.read_import(import_filename, rules)
+    current_account = Account.read_current(current_filename)
+    timings["read"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    journal = Journal(current_filename)
+    if backup:
+        journal.snapshot(current_filename + ".backup")
+    matcher = None if fuzzy_threshold is None else DuplicateMatcher(threshold=fuzzy_threshold)
+    export_account = current_account.merge(import_account, matcher)
+    timings["merge"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    export_account.append_current(current_filename, current_account)
+    timings["write"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    journal.compact()
+    timings["compact"] = time.perf_counter() - start
+
+    summary = {"imported_transactions": len(import_account.table),
+               "current_transactions": len(current_account.table),
+               "exported_transactions": len(export_account.table)}
+    if matcher is not None:
+        report = matcher.write(current_filename, import_account.imported_at)
+        summary["fuzzy_duplicates"] = len(matcher.matches)
+        summary["duplicates_report"] = report if len(matcher.matches) > 0 else None
+    return (export_account, summary, timings)
+
+
+def process_account(import_filename, current_filename, synthesis=False, only_last_month=False, backup=False, compact=False, rules_filename=None, fuzzy_threshold=FUZZY_THRESHOLD):
+    summary = {"import": import_filename,
+               "current": current_filename,
+               "outputs": [],
+               "timings": {},
+               "error": None}
+
+    try:
+        if import_filename is not None:
+            (account, counts, timings) = merge_account(
+                import_filename, current_filename, backup, rules_filename, fuzzy_threshold)
+            summary.update(counts)
+            summary["timings"].update(timings)
+            summary["outputs"].append(current_filename)
+            if counts.get("duplicates_report") is not None:
+                summary["outputs"].append(counts["duplicates_report"])
+        else:
+            start = time.perf_counter()
+            if compact:
+                Journal(current_filename).compact()
+            account = Account.read_current(current_filename)
+            summary["timings"]["read"] = time.perf_counter() - start
+            summary["current_transactions"] = len(account.table)
+
+        if synthesis:
+            start = time.perf_counter()
+            directory = os.path.dirname(os.path.abspath(current_filename))
+            name = os.path.splitext(os.path.basename(current_filename))[0]
+            summary["outputs"] += synthetize(account, only_last_month,
+                                             directory=directory, name=name)
+            summary["timings"]["synthesis"] = time.perf_counter() - start
+
+    except Exception as e:
+        traceback.print_exception(e)
+        summary["error"] = f"{type(e).__name__}: {e}"
+
+    if timing.is_enabled():
+        summary["stages"] = timing.collect()
+
+    return summary
+
+
+def consolidate_accounts(current_filenames, directory, only_last_month=False, workers=1):
+    summary = {"currents": current_filenames,
+               "outputs": [],
+               "timings": {},
+               "error": None}
+
+    try:
+        start = time.perf_counter()
+        portfolio = Portfolio.read_current(current_filenames)
+        summary["timings"]["read"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        os.makedirs(directory, exist_ok=True)
+        summary["outputs"] = synthetize_portfolio(portfolio, only_last_month,
+                                                  workers, directory=directory)
+        summary["timings"]["synthesis"] = time.perf_counter() - start
+
+    except Exception as e:
+        traceback.print_exception(e)
+        summary["error"] = f"{type(e).__name__}: {e}"
+
+    return summary
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Merge bank exports into current records and render synthesis reports")
+    parser.add_argument("--pair", nargs=2, action="append", default=[],
+                        metavar=("IMPORT", "CURRENT"),
+                        help="merge an import record into a current record")
+    parser.add_argument("--current", action="append", default=[],
+                        help="current record to synthetize without merging")
+    parser.add_argument("--synthetize", action="store_true",
+                        help="render synthesis reports next to each current record")
+    parser.add_argument("--only-last-month", action="store_true",
+                        help="only render the last monthly report")
+    parser.add_argument("--backup", action="store_true",
+                        help="snapshot current records before merging")
+    parser.add_argument("--rules", default=None,
+                        help="categorization rules applied to imports, defaults to rules.csv next to each current record")
+    parser.add_argument("--fuzzy-threshold", type=float, default=FUZZY_THRESHOLD,
+                        help="label similarity above which a reformatted import transaction is a duplicate")
+    parser.add_argument("--no-fuzzy", action="store_true",
+                        help="only treat identical transactions as duplicates")
+    parser.add_argument("--compact", action="store_true",
+                        help="fold journals left by interrupted merges into --current records")
+    parser.add_argument("--portfolio", default=None, metavar="DIRECTORY",
+                        help="render consolidated reports of all current records into this directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of accounts processed concurrently")
+    parser.add_argument("--summary", default=None,
+                        help="write the JSON summary to this file instead of stdout")
+    parser.add_argument("--timings", action="store_true",
+                        help="record per-stage timings in the summary")
+    parser.add_argument("--profile", default=None,
+                        help="run accounts in this process under cProfile and dump stats to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    accounts = [tuple(pair) for pair in args.pair] + \
+        [(None, current) for current in args.current]
+    if len(accounts) == 0:
+        print("Nothing to do, use --pair or --current", file=sys.stderr)
+        return 2
+
+    if args.timings:
+        timing.enable()
+
+    start = time.perf_counter()
+    jobs = [(import_filename, current_filename, args.synthetize, args.only_last_month, args.backup, args.compact, args.rules,
+             None if args.no_fuzzy else args.fuzzy_threshold)
+            for import_filename, current_filename in accounts]
+    if args.profile is not None:
+        init_worker(args.timings)
+        with timing.profile(args.profile):
+            results = [process_account(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=max(args.workers, 1),
+                                 initializer=init_worker,
+                                 initargs=(args.timings,)) as executor:
+            futures = [executor.submit(process_account, *job) for job in jobs]
+            results = [future.result() for future in futures]
+
+    summary = {"accounts": results,
+               "failed": sum(r["error"] is not None for r in results)}
+
+    if args.portfolio is not None:
+        summary["portfolio"] = consolidate_accounts(
+            [current for _, current in accounts], args.portfolio,
+            args.only_last_month, args.workers)
+        summary["failed"] += summary["portfolio"]["error"] is not None
+
+    summary["elapsed"] = time.perf_counter() - start
+
+    if args.summary is None:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.summary, mode="w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=2)
+
+    return 1 if summary["failed"] > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
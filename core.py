@@ -1,30 +1,137 @@
 import csv
 import datetime
+import hashlib
+import io
 import math
+import os
+import shutil
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice, repeat
 
-import xlrd
-
-DAY_DELTA = datetime.timedelta(days=1)
-MONTH_DELTA = datetime.timedelta(days=31)
+import numpy as np
 
+from timing import timed
 
+DAY_DELTA = datetime.timedelta(days=1)
+WEEK_DELTA = datetime.timedelta(days=7)
+PERIOD_MONTHS = {"month": 1, "quarter": 3, "year": 12}
+EPOCH = datetime.date(1970, 1, 1)
+FOUR_DIGIT_YEARS_DAY = (datetime.date(1000, 1, 1) - EPOCH).days
+CHUNK_SIZE = 8192
+LEDGER_CACHE_VERSION = 1
+JOURNAL_VERSION = 1
+IMPORT_HEADER_ROWS = 3
+IMPORT_COLUMNS = 5
+IMPORT_TEXT_COLUMNS = (1, 2, 3)
+
+
+def to_text(value):
+    # Spreadsheets give numbers for numeric cells, 1234567 is read as 1234567.0
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+@timed("core.read_xls")
 def read_xls_file(filepath):
+    import xlrd
+
     book = xlrd.open_workbook(filepath, encoding_override="cp1252")
     sheet = book.sheet_by_index(0)
     return [sheet.row_values(i) for i in range(0, sheet.nrows)]
 
 
+@timed("core.read_xls_columns")
+def read_xls_columns(filepath):
+    import xlrd
+
+    book = xlrd.open_workbook(filepath, encoding_override="cp1252",
+                              on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        header = sheet.row_values(0)
+        columns = [sheet.col_values(col, start_rowx=IMPORT_HEADER_ROWS)
+                   for col in range(IMPORT_COLUMNS)]
+        for col in IMPORT_TEXT_COLUMNS:
+            columns[col] = list(map(to_text, columns[col]))
+    finally:
+        book.release_resources()
+    return (header, columns)
+
+
+@timed("core.read_xlsx_columns")
+def read_xlsx_columns(filepath):
+    import openpyxl
+
+    book = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = book.worksheets[0].iter_rows(max_col=IMPORT_COLUMNS,
+                                            values_only=True)
+        header = next(rows)
+        columns = [[] for _ in range(IMPORT_COLUMNS)]
+        for idx, row in enumerate(rows, start=1):
+            if idx < IMPORT_HEADER_ROWS or row[0] is None:
+                continue
+            for column, value in zip(columns, row):
+                column.append(value)
+        for col in IMPORT_TEXT_COLUMNS:
+            columns[col] = list(map(to_text, columns[col]))
+    finally:
+        book.close()
+    return (header, columns)
+
+
+def read_import_columns(filepath):
+    if os.path.splitext(filepath)[1].lower() == ".xlsx":
+        return read_xlsx_columns(filepath)
+    return read_xls_columns(filepath)
+
+
 def read_csv_file(filepath):
+    return list(iter_csv_file(filepath))
+
+
+def iter_csv_file(filepath):
     with open(filepath, newline="", encoding="utf-8") as file:
-        reader = csv.reader(file, delimiter=";")
-        data = list(reader)
-    return data
+        yield from csv.reader(file, delimiter=";")
 
 
+@timed("core.write_csv")
 def write_csv_file(filepath, rows):
-    with open(filepath, mode="w", newline="", encoding="utf-8") as file:
+    tmp_filepath = filepath + ".tmp"
+    with open(tmp_filepath, mode="w", newline="", encoding="utf-8") as file:
         writer = csv.writer(file, delimiter=";")
         writer.writerows(rows)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_filepath, filepath)
+
+
+def append_csv_file(filepath, rows):
+    buffer = io.StringIO(newline="")
+    csv.writer(buffer, delimiter=";").writerows(rows)
+    with open(filepath, mode="a", newline="", encoding="utf-8") as file:
+        file.write(buffer.getvalue())
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def file_signature(filepath):
+    stat = os.stat(filepath)
+    return np.array([LEDGER_CACHE_VERSION, stat.st_size, stat.st_mtime_ns],
+                    dtype=np.int64)
+
+
+def ledger_cache_filepath(filepath):
+    return filepath + ".npz"
+
+
+def journal_filepath(filepath):
+    return filepath + ".journal"
 
 
 def parse_french_date(date, delimiter="-"):
@@ -32,10 +139,86 @@ def parse_french_date(date, delimiter="-"):
     return datetime.date(values[2], values[1], values[0])
 
 
+def to_date(value, delimiter="-"):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return parse_french_date(value, delimiter)
+
+
+def decode_french_amounts(amounts):
+    joined = ";".join(amounts).replace(",", ".")
+    return np.array(joined.split(";") if amounts else [], dtype=np.float64)
+
+
 def make_french_date(date, delimiter="-"):
     return date.strftime(f"%d{delimiter}%m{delimiter}%Y")
 
 
+def encode_french_amounts(amounts):
+    joined = ";".join(map(str, amounts)).replace(".", ",")
+    return joined.split(";") if len(amounts) > 0 else []
+
+
+class DateCodec:
+    delimiter: str
+    days: dict[str, int]
+    strings: dict[int, str]
+
+    def __init__(self, delimiter="-"):
+        self.delimiter = delimiter
+        self.days = {}
+        self.strings = {}
+
+    def _day(self, value):
+        try:
+            return self.days[value]
+        except KeyError:
+            day = (to_date(value, self.delimiter) - EPOCH).days
+            return self.days.setdefault(value, day)
+
+    def _string(self, day):
+        try:
+            return self.strings[day]
+        except KeyError:
+            date = EPOCH + datetime.timedelta(days=day)
+            return self.strings.setdefault(day, make_french_date(date, self.delimiter))
+
+    def decode(self, value) -> datetime.date:
+        return EPOCH + datetime.timedelta(days=self._day(value))
+
+    def encode(self, date: datetime.date) -> str:
+        return self._string((date - EPOCH).days)
+
+    def decode_many(self, values) -> np.ndarray:
+        days = [self._day(v) for v in values]
+        return np.array(days, dtype=np.int64).astype("datetime64[D]")
+
+    def encode_many(self, dates) -> list[str]:
+        days = to_datetime64(dates).astype(np.int64)
+        (unique, inverse) = np.unique(days, return_inverse=True)
+        missing = [d for d in unique.tolist() if d not in self.strings]
+        if missing:
+            self.strings.update(zip(missing, self._format_many(missing)))
+        strings = np.array([self.strings[d] for d in unique.tolist()],
+                           dtype=object)
+        return strings[inverse].tolist()
+
+    def _format_many(self, days) -> list[str]:
+        if min(days) < FOUR_DIGIT_YEARS_DAY:
+            return [make_french_date(EPOCH + datetime.timedelta(days=d), self.delimiter)
+                    for d in days]
+        iso = np.datetime_as_string(to_datetime64(days), unit="D")
+        chars = iso.astype("U10").view("U1").reshape(-1, 10)
+        chars = chars[:, [8, 9, 4, 5, 6, 7, 0, 1, 2, 3]]
+        chars[:, [2, 5]] = self.delimiter
+        return np.ascontiguousarray(chars).view("U10").ravel().tolist()
+
+
+FRENCH_DATES = DateCodec("-")
+
+
 def some(array, predicate):
     for x in array:
         if predicate(x):
@@ -43,6 +226,12 @@ def some(array, predicate):
     return False
 
 
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
 def partition(array, predicate):
     positives = []
     negatives = []
@@ -65,14 +254,47 @@ def make_linear_date(start: datetime.date, end: datetime.date):
     return [start + i * delta for i in range(periods)]
 
 
-def make_accounting_term_dates(start: datetime.date, end: datetime.date):
-    term_start = datetime.date(start.year, start.month, 1)
-    month_duration = (end - term_start).days / 30
+def period_start(date: datetime.date, granularity: str):
+    if granularity == "day":
+        return date
+    if granularity == "week":
+        return date - datetime.timedelta(days=date.weekday())
+    if granularity == "month":
+        return datetime.date(date.year, date.month, 1)
+    if granularity == "quarter":
+        return datetime.date(date.year, 3 * ((date.month - 1) // 3) + 1, 1)
+    if granularity == "year":
+        return datetime.date(date.year, 1, 1)
+    raise ValueError(f"Unknown period granularity {granularity}")
+
 
-    delta = MONTH_DELTA
-    periods = math.ceil(month_duration) + 1
-    shifted_dates = [term_start + i * delta for i in range(periods)]
-    return [datetime.date(d.year, d.month, 1) for d in shifted_dates]
+def add_months(date: datetime.date, months: int):
+    month = date.month - 1 + months
+    return datetime.date(date.year + month // 12, month % 12 + 1, 1)
+
+
+def next_period(date: datetime.date, granularity: str):
+    if granularity == "day":
+        return date + DAY_DELTA
+    if granularity == "week":
+        return date + WEEK_DELTA
+    return add_months(date, PERIOD_MONTHS[granularity])
+
+
+def make_period_dates(start: datetime.date, end: datetime.date, granularity: str):
+    dates = [period_start(start, granularity)]
+    while dates[-1] <= end:
+        dates.append(next_period(dates[-1], granularity))
+    return dates
+
+
+def make_year_days(start: datetime.date, end: datetime.date):
+    return np.arange(np.datetime64(period_start(start, "year"), "D"),
+                     np.datetime64(datetime.date(end.year + 1, 1, 1), "D"))
+
+
+def make_accounting_term_dates(start: datetime.date, end: datetime.date):
+    return make_period_dates(start, end, "month")
 
 
 def make_accounting_term_date(year: float, month: float):
@@ -90,74 +312,101 @@ def group_by(keys, values):
     return grouped
 
 
-def sample(dates: list, data: dict):
-    new_data = {}
+def to_datetime64(dates):
+    return np.asarray(dates, dtype="datetime64[D]")
 
-    sorted_dates = sorted(data.keys())
-    initial_dates = [d for d in sorted_dates if d <= dates[0]]
 
-    try:
-        last_known = data[initial_dates[-1]][-1]
-    except IndexError:
-        last_known = 0.0
+def unpack(data: dict):
+    keys = to_datetime64(list(data.keys()))
+    counts = [len(v) for v in data.values()]
+    values = np.fromiter(chain.from_iterable(data.values()),
+                         dtype=np.float64, count=sum(counts))
+    return (np.repeat(keys, counts), values)
 
-    for d in dates:
-        try:
-            new_data[d] = data[d][-1]
-            last_known = new_data[d]
-        except KeyError:
-            new_data[d] = last_known
 
-    return unzip(sorted(new_data.items(), key=lambda i: i[0]))[1]
+def resample_sum(edges, dates, values):
+    edges = to_datetime64(edges)
+    idx = np.searchsorted(edges, dates, side="left")
+    in_range = (idx < len(edges)) & ((idx > 0) | (dates == edges[0]))
+    summed = np.bincount(idx[in_range], weights=values[in_range],
+                         minlength=len(edges))
+    return summed.astype(np.float64, copy=False)
 
 
-def aggregate(dates, data):
-    try:
-        new_data = {dates[0]: sum(data[dates[0]])}
-    except KeyError:
-        new_data = {dates[0]: 0.0}
-    for current_date, next_date in zip(dates[:-1], dates[1:]):
-        date_range = make_linear_date(current_date, next_date)
+def resample_last(edges, dates, values, default=0.0):
+    edges = to_datetime64(edges)
+    if len(dates) == 0:
+        return np.full(len(edges), default)
 
-        try:
-            new_data[next_date] = sum(data[next_date])
-        except KeyError:
-            new_data[next_date] = 0.0
+    order = np.argsort(dates, kind="stable")
+    idx = np.searchsorted(dates[order], edges, side="right") - 1
+    last = values[order][np.maximum(idx, 0)]
+    return np.where(idx >= 0, last, default)
 
-        for d in date_range[1:-1]:
-            try:
-                new_data[next_date] += sum(data[d])
-            except KeyError:
-                new_data[next_date] += 0.0
 
-    return unzip(sorted(new_data.items(), key=lambda i: i[0]))[1]
+@timed("core.sample")
+def sample(dates: list, data: dict):
+    keys = to_datetime64(list(data.keys()))
+    values = np.array([v[-1] for v in data.values()], dtype=np.float64)
+
+    # Values recorded between two sampled dates are not carried forward
+    edges = to_datetime64(dates)
+    seen = (keys <= edges[0]) | np.isin(keys, edges)
+    return resample_last(edges, keys[seen], values[seen])
+
+
+@timed("core.aggregate")
+def aggregate(dates, data):
+    return resample_sum(dates, *unpack(data))
 
 
 def cumulate(data):
-    cumulated = [data[0]] + [0] * (len(data) - 1)
-    for idx, x in enumerate(data[1:]):
-        cumulated[idx + 1] = x + cumulated[idx]
+    return np.cumsum(data, dtype=np.float64)
 
-    return cumulated
+
+def rolling_sum(half_period: int, data):
+    data = np.asarray(data, dtype=np.float64)
+    length = len(data)
+    summed = np.zeros(length)
+    if length <= 2 * half_period:
+        return summed
+
+    prefix = np.concatenate(([0.0], np.cumsum(data)))
+    summed[half_period:length - half_period] = \
+        prefix[2 * half_period:length] - prefix[:length - 2 * half_period]
+    return summed
+
+
+def rolling_mean(period: int, data):
+    half_period = round(period / 2)
+    return rolling_sum(half_period, data) / period
 
 
 def smooth(period: int, data: list[float]):
     if (period <= 1):
         return data
-    half_period = round(period / 2)
-    smoothed = [0] * len(data)
-    for idx in range(half_period, len(data) - half_period):
-        total = sum(data[idx - half_period:idx + half_period])
-        smoothed[idx] = total / period
-
-    return smoothed
+    return rolling_mean(period, data)
 
 
 def invert(data):
     return [-x for x in data]
 
 
+def encode(values, codes=None):
+    codes = {} if codes is None else codes
+    encoded = [codes.setdefault(v, len(codes)) for v in values]
+    return (np.array(encoded, dtype=np.int32), list(codes))
+
+
+def remap(values, other_values, other_codes):
+    codes = {v: i for i, v in enumerate(values)}
+    (mapping, values) = encode(other_values, codes)
+    return (values, mapping[other_codes])
+
+
 class Transaction:
+    __slots__ = ("occured_at", "category", "sub_category", "label", "amount")
+
     occured_at: datetime.date
     category: str
     sub_category: str
@@ -166,17 +415,25 @@ class Transaction:
 
     def __init__(self, occured_at, category, sub_category, label, amount):
         self.occured_at = occured_at
-        self.category = category
-        self.sub_category = sub_category
-        self.label = label
+        self.category = sys.intern(category)
+        self.sub_category = sys.intern(sub_category)
+        self.label = sys.intern(label)
         self.amount = amount
 
+    def __eq__(self, other):
+        if not isinstance(other, Transaction):
+            return NotImplemented
+        return self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
     def is_initial(self):
         return self.label == "initial"
 
     def to_export(self):
         return [
-            make_french_date(self.occured_at),
+            FRENCH_DATES.encode(self.occured_at),
             self.category,
             self.sub_category,
             self.label,
@@ -184,14 +441,14 @@ class Transaction:
         ]
 
     def is_same(self, other):
-        is_same_date = self.occured_at == other.occured_at
-        is_same_label = self.label == other.label
-        is_same_amount = self.amount == other.amount
-        return is_same_date and is_same_label and is_same_amount
+        return self.key() == other.key()
+
+    def key(self):
+        return (self.occured_at, self.label, self.amount)
 
     @ staticmethod
     def parse_import(row):
-        occured_at = parse_french_date(row[0])
+        occured_at = FRENCH_DATES.decode(row[0])
         category = row[1]
         sub_category = row[2]
         label = row[3]
@@ -200,7 +457,7 @@ class Transaction:
 
     @ staticmethod
     def parse_current(row):
-        occured_at = parse_french_date(row[1])
+        occured_at = FRENCH_DATES.decode(row[1])
         category = row[2]
         sub_category = row[3]
         label = row[4]
@@ -216,42 +473,621 @@ class Transaction:
                            amount=amount)
 
 
+class TransactionTable:
+    occured_at: np.ndarray
+    amount: np.ndarray
+    category: np.ndarray
+    sub_category: np.ndarray
+    label: np.ndarray
+    categories: list[str]
+    sub_categories: list[str]
+    labels: list[str]
+
+    def __init__(self, occured_at, amount, category, sub_category, label,
+                 categories, sub_categories, labels):
+        self.occured_at = occured_at
+        self.amount = amount
+        self.category = category
+        self.sub_category = sub_category
+        self.label = label
+        self.categories = categories
+        self.sub_categories = sub_categories
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.amount)
+
+    def select(self, mask):
+        return TransactionTable(self.occured_at[mask],
+                                self.amount[mask],
+                                self.category[mask],
+                                self.sub_category[mask],
+                                self.label[mask],
+                                self.categories,
+                                self.sub_categories,
+                                self.labels)
+
+    def concatenate(self, other):
+        (categories, category) = remap(self.categories, other.categories, other.category)
+        (sub_categories, sub_category) = remap(self.sub_categories, other.sub_categories,
+                                               other.sub_category)
+        (labels, label) = remap(self.labels, other.labels, other.label)
+        return TransactionTable(np.concatenate((self.occured_at, other.occured_at)),
+                                np.concatenate((self.amount, other.amount)),
+                                np.concatenate((self.category, category)),
+                                np.concatenate((self.sub_category, sub_category)),
+                                np.concatenate((self.label, label)),
+                                categories,
+                                sub_categories,
+                                labels)
+
+    def first_difference(self, other):
+        length = min(len(self), len(other))
+        same = (self.occured_at[:length] == other.occured_at[:length]) & \
+            (self.amount[:length] == other.amount[:length])
+        for codes, values, other_codes, other_values in (
+                (self.category, self.categories, other.category, other.categories),
+                (self.sub_category, self.sub_categories, other.sub_category, other.sub_categories),
+                (self.label, self.labels, other.label, other.labels)):
+            same &= np.asarray(values, dtype=object)[codes[:length]] == \
+                np.asarray(other_values, dtype=object)[other_codes[:length]]
+        different = np.flatnonzero(~same)
+        return int(different[0]) if len(different) > 0 else length
+
+    def to_rows(self, first=1):
+        return list(map(list, zip(range(first, first + len(self)),
+                                  FRENCH_DATES.encode_many(self.occured_at),
+                                  [self.categories[c] for c in self.category.tolist()],
+                                  [self.sub_categories[c]
+                                   for c in self.sub_category.tolist()],
+                                  [self.labels[c] for c in self.label.tolist()],
+                                  encode_french_amounts(self.amount.tolist()))))
+
+    def is_initial(self):
+        try:
+            code = self.labels.index("initial")
+        except ValueError:
+            return np.zeros(len(self), dtype=bool)
+        return self.label == code
+
+    def to_transactions(self):
+        categories = [self.categories[c] for c in self.category.tolist()]
+        sub_categories = [self.sub_categories[c]
+                          for c in self.sub_category.tolist()]
+        labels = [self.labels[c] for c in self.label.tolist()]
+        return list(map(Transaction,
+                        self.occured_at.tolist(),
+                        categories,
+                        sub_categories,
+                        labels,
+                        self.amount.tolist()))
+
+    def to_arrays(self):
+        return {"occured_at": self.occured_at.view(np.int64),
+                "amount": self.amount,
+                "category": self.category,
+                "sub_category": self.sub_category,
+                "label": self.label,
+                "categories": np.array(self.categories, dtype=str),
+                "sub_categories": np.array(self.sub_categories, dtype=str),
+                "labels": np.array(self.labels, dtype=str)}
+
+    @ staticmethod
+    def from_arrays(arrays):
+        return TransactionTable(arrays["occured_at"].view("datetime64[D]"),
+                                arrays["amount"],
+                                arrays["category"],
+                                arrays["sub_category"],
+                                arrays["label"],
+                                arrays["categories"].tolist(),
+                                arrays["sub_categories"].tolist(),
+                                arrays["labels"].tolist())
+
+    @ staticmethod
+    def from_columns(occured_at, category, sub_category, label, amount):
+        builder = TransactionTableBuilder()
+        builder.append(occured_at, category, sub_category, label, amount)
+        return builder.build()
+
+    @ staticmethod
+    def from_transactions(transactions):
+        return TransactionTable.from_columns(
+            [t.occured_at for t in transactions],
+            [t.category for t in transactions],
+            [t.sub_category for t in transactions],
+            [t.label for t in transactions],
+            [t.amount for t in transactions])
+
+    @ staticmethod
+    def parse_import(columns):
+        builder = TransactionTableBuilder()
+        builder.append_import(columns)
+        return builder.build()
+
+    @ staticmethod
+    def parse_current(rows):
+        builder = TransactionTableBuilder()
+        builder.append_current(rows)
+        return builder.build()
+
+
+class TransactionTableBuilder:
+    occured_at: list[np.ndarray]
+    amount: list[np.ndarray]
+    category: list[np.ndarray]
+    sub_category: list[np.ndarray]
+    label: list[np.ndarray]
+    category_codes: dict[str, int]
+    sub_category_codes: dict[str, int]
+    label_codes: dict[str, int]
+
+    def __init__(self):
+        self.occured_at = []
+        self.amount = []
+        self.category = []
+        self.sub_category = []
+        self.label = []
+        self.category_codes = {}
+        self.sub_category_codes = {}
+        self.label_codes = {}
+
+    def append(self, occured_at, category, sub_category, label, amount):
+        self.occured_at.append(np.array(occured_at, dtype="datetime64[D]"))
+        self.amount.append(np.array(amount, dtype=np.float64))
+        self.category.append(encode(category, self.category_codes)[0])
+        self.sub_category.append(
+            encode(sub_category, self.sub_category_codes)[0])
+        self.label.append(encode(label, self.label_codes)[0])
+
+    def append_current(self, rows):
+        if len(rows) == 0:
+            return
+        columns = list(zip(*rows))
+        self.append(FRENCH_DATES.decode_many(columns[1]),
+                    columns[2],
+                    columns[3],
+                    columns[4],
+                    decode_french_amounts(columns[5]))
+
+    def append_import(self, columns):
+        if len(columns[0]) == 0:
+            return
+        self.append(FRENCH_DATES.decode_many(columns[0]),
+                    columns[1],
+                    columns[2],
+                    columns[3],
+                    np.array(columns[4], dtype=np.float64))
+
+    def build(self):
+        def concatenate(chunks, dtype):
+            return np.concatenate(chunks) if chunks else np.array([], dtype=dtype)
+
+        return TransactionTable(concatenate(self.occured_at, "datetime64[D]"),
+                                concatenate(self.amount, np.float64),
+                                concatenate(self.category, np.int32),
+                                concatenate(self.sub_category, np.int32),
+                                concatenate(self.label, np.int32),
+                                list(self.category_codes),
+                                list(self.sub_category_codes),
+                                list(self.label_codes))
+
+
+class CategoryIndex:
+    order: np.ndarray
+    occured_at: np.ndarray
+    amount: np.ndarray
+    prefix: np.ndarray
+    groups: dict[str, dict[str, tuple[int, int]]]
+
+    @timed("core.category_index")
+    def __init__(self, table: TransactionTable):
+        sub_count = max(len(table.sub_categories), 1)
+        group = table.category.astype(np.int64) * sub_count + table.sub_category
+
+        self.order = np.lexsort((table.occured_at, group))
+        self.occured_at = table.occured_at[self.order]
+        self.amount = table.amount[self.order]
+        self.prefix = np.concatenate(([0.0], np.cumsum(self.amount)))
+
+        codes, starts, counts = np.unique(group[self.order],
+                                          return_index=True,
+                                          return_counts=True)
+        first_seen = np.unique(group, return_index=True)[1]
+
+        self.groups = {}
+        for idx in np.argsort(first_seen, kind="stable").tolist():
+            code = int(codes[idx])
+            category = table.categories[code // sub_count]
+            sub_category = table.sub_categories[code % sub_count]
+            start = int(starts[idx])
+            self.groups.setdefault(category, {})[sub_category] = \
+                (start, start + int(counts[idx]))
+
+    def _range(self, bounds, start=None, end=None):
+        (lo, hi) = bounds
+        dates = self.occured_at[lo:hi]
+        if start is not None:
+            lo += int(np.searchsorted(dates, np.datetime64(start), side="left"))
+        if end is not None:
+            hi -= len(dates) - \
+                int(np.searchsorted(dates, np.datetime64(end), side="right"))
+        return (lo, hi)
+
+    def _ranges(self, category, sub_category=None, start=None, end=None):
+        sub_categories = self.groups.get(category, {})
+        if sub_category is not None:
+            sub_categories = {sub_category: sub_categories[sub_category]} \
+                if sub_category in sub_categories else {}
+        return [self._range(b, start, end) for b in sub_categories.values()]
+
+    def _rows(self, ranges):
+        rows = np.concatenate([np.arange(lo, hi) for lo, hi in ranges] or
+                              [np.array([], dtype=np.intp)])
+        return rows[np.argsort(self.order[rows], kind="stable")]
+
+    def slice(self, category, sub_category=None, start=None, end=None):
+        rows = self._rows(self._ranges(category, sub_category, start, end))
+        return (self.occured_at[rows], self.amount[rows])
+
+    def total(self, category, sub_category=None, start=None, end=None):
+        ranges = self._ranges(category, sub_category, start, end)
+        return float(sum(self.prefix[hi] - self.prefix[lo] for lo, hi in ranges))
+
+    def series(self, dates, category, sub_category=None):
+        return resample_sum(dates, *self.slice(category, sub_category,
+                                               dates[0], dates[-1]))
+
+    def amounts_by_date(self, category, sub_category=None, start=None, end=None):
+        (dates, amounts) = self.slice(category, sub_category, start, end)
+        return group_by(dates.tolist(), amounts.tolist())
+
+    def by_category(self, start=None, end=None):
+        return {category: self.amounts_by_date(category, None, start, end)
+                for category in self.groups}
+
+    def by_sub_category(self, start=None, end=None):
+        return {category: {sub_category: self.amounts_by_date(category, sub_category, start, end)
+                           for sub_category in sub_categories}
+                for category, sub_categories in self.groups.items()}
+
+
+class RangeIndex:
+    order: np.ndarray
+    occured_at: np.ndarray
+    amount: np.ndarray
+    balance: np.ndarray
+    gain: np.ndarray
+    loss: np.ndarray
+    amount_prefix: np.ndarray
+    gain_prefix: np.ndarray
+    loss_prefix: np.ndarray
+    initial_balance: float
+
+    def __init__(self, table: TransactionTable, initial_balance: float):
+        amounts = np.concatenate(([initial_balance], table.amount))
+        balance = np.cumsum(amounts)[1:]
+
+        self.initial_balance = initial_balance
+        self.order = np.argsort(table.occured_at, kind="stable")
+        self.occured_at = table.occured_at[self.order]
+        self.amount = table.amount[self.order]
+        self.balance = balance[self.order]
+        self.gain = np.clip(self.amount, 0, None)
+        self.loss = np.clip(-self.amount, 0, None)
+        self.amount_prefix = np.concatenate(([0.0], np.cumsum(self.amount)))
+        self.gain_prefix = np.concatenate(([0.0], np.cumsum(self.gain)))
+        self.loss_prefix = np.concatenate(([0.0], np.cumsum(self.loss)))
+
+    def slice(self, start=None, end=None):
+        lo = 0 if start is None else \
+            int(np.searchsorted(self.occured_at, np.datetime64(start), side="left"))
+        hi = len(self.occured_at) if end is None else \
+            int(np.searchsorted(self.occured_at, np.datetime64(end), side="right"))
+        return (lo, max(lo, hi))
+
+    def balance_at(self, date, default=None):
+        idx = int(np.searchsorted(self.occured_at, np.datetime64(date), side="right")) - 1
+        if idx < 0:
+            return self.initial_balance if default is None else default
+        return float(self.balance[idx])
+
+    def opening_balance(self, date):
+        (lo, _) = self.slice(date)
+        return self.initial_balance + float(self.amount_prefix[lo])
+
+    def total_gain(self, start=None, end=None):
+        (lo, hi) = self.slice(start, end)
+        return float(self.gain_prefix[hi] - self.gain_prefix[lo])
+
+    def total_loss(self, start=None, end=None):
+        (lo, hi) = self.slice(start, end)
+        return float(self.loss_prefix[hi] - self.loss_prefix[lo])
+
+    def balance_series(self, dates):
+        (lo, hi) = self.slice(dates[0], dates[-1])
+        edges = to_datetime64(dates)
+        keys = self.occured_at[lo:hi]
+
+        # Like sample(), values recorded between two sampled dates are not carried forward
+        seen = (keys <= edges[0]) | np.isin(keys, edges)
+        opening = self.balance_at(edges[0] - 1, default=0.0)
+        return resample_last(edges, keys[seen], self.balance[lo:hi][seen], opening)
+
+    def gain_series(self, dates):
+        (lo, hi) = self.slice(dates[0], dates[-1])
+        return resample_sum(dates, self.occured_at[lo:hi], self.gain[lo:hi])
+
+    def loss_series(self, dates):
+        (lo, hi) = self.slice(dates[0], dates[-1])
+        return resample_sum(dates, self.occured_at[lo:hi], self.loss[lo:hi])
+
+
+class PeriodRollup:
+    dates: np.ndarray
+    levels: dict[str, tuple[np.ndarray, dict[str, np.ndarray]]]
+    prefixes: dict[str, np.ndarray]
+
+    # Coarser levels are summed from the level below instead of from the days
+    ROLLUPS = {"quarter": ("month", 3), "year": ("quarter", 4)}
+
+    def __init__(self, dates, series: dict[str, np.ndarray]):
+        # Days must cover whole years so that months, quarters and years nest
+        self.dates = to_datetime64(dates)
+        self.levels = {"day": (self.dates, series)}
+        self.prefixes = {}
+
+    @ staticmethod
+    @timed("core.period_rollup")
+    def from_account(account):
+        dates = make_year_days(account.started_at(), account.ended_at())
+        index = account.range_index()
+        return PeriodRollup(dates, {"gain": index.gain_series(dates),
+                                    "loss": index.loss_series(dates)})
+
+    @ staticmethod
+    def from_series(dates, series: dict[str, np.ndarray]):
+        days = make_year_days(dates[0], dates[-1])
+        lo = (dates[0] - days[0].item()).days
+        padded = {}
+        for name, values in series.items():
+            padded[name] = np.zeros(len(days))
+            padded[name][lo:lo + len(values)] = values
+        return PeriodRollup(days, padded)
+
+    def level(self, granularity):
+        try:
+            return self.levels[granularity]
+        except KeyError:
+            pass
+
+        if granularity in self.ROLLUPS:
+            (finer, size) = self.ROLLUPS[granularity]
+            (starts, series) = self.level(finer)
+            level = (starts[::size],
+                     {name: values.reshape(-1, size).sum(axis=1)
+                      for name, values in series.items()})
+        else:
+            (days, series) = self.levels["day"]
+            edges = to_datetime64(make_period_dates(days[0].item(), days[-1].item(),
+                                                    granularity))
+            idx = np.clip((edges - days[0]).astype(np.int64), 0, len(days))
+            level = (edges[:-1], {})
+            for name in series:
+                prefix = self.prefix(name)
+                level[1][name] = prefix[idx[1:]] - prefix[idx[:-1]]
+
+        self.levels[granularity] = level
+        return level
+
+    def prefix(self, name):
+        try:
+            return self.prefixes[name]
+        except KeyError:
+            values = self.levels["day"][1][name]
+            prefix = self.prefixes[name] = np.concatenate(([0.0], np.cumsum(values)))
+            return prefix
+
+    def window_sum(self, name, start, end):
+        days = self.levels["day"][0]
+        idx = np.clip((np.array([start, end]) - days[0]).astype(np.int64), 0, len(days))
+        prefix = self.prefix(name)
+        return prefix[idx[1]] - prefix[idx[0]]
+
+    def totals(self, granularity, start=None, end=None):
+        (starts, series) = self.level(granularity)
+        days = self.levels["day"][0]
+        start = days[0] if start is None else np.datetime64(start, "D")
+        end = days[-1] + 1 if end is None else np.datetime64(end, "D")
+        lo = max(int(np.searchsorted(starts, start, side="right")) - 1, 0)
+        hi = int(np.searchsorted(starts, end, side="left"))
+        totals = {name: values[lo:hi].copy() for name, values in series.items()}
+
+        # Periods straddling the window, such as the weeks at the edges of a
+        # quarter, only count the days inside it
+        ends = np.append(starts[1:], days[-1] + 1)
+        for i in {lo, hi - 1} if hi > lo else ():
+            if starts[i] < start or ends[i] > end:
+                for name in totals:
+                    totals[name][i - lo] = self.window_sum(name, max(starts[i], start),
+                                                           min(ends[i], end))
+        return (starts[lo:hi].tolist(), totals)
+
+
 class Account:
     initial_balance: float
-    transactions: list[Transaction]
     imported_at: datetime.date
+    _transactions: list[Transaction] | None
+    _table: TransactionTable | None
+    _category_index: CategoryIndex | None
+    _range_index: RangeIndex | None
+    _rollup: PeriodRollup | None
 
-    def __init__(self, initial_balance, imported_at, transactions):
+    def __init__(self, initial_balance, imported_at, transactions=None, table=None):
         self.initial_balance = initial_balance
         self.imported_at = imported_at
-        self.transactions = transactions
+        self._transactions = transactions
+        self._table = table
+        self._category_index = None
+        self._range_index = None
+        self._rollup = None
+
+    @ property
+    def transactions(self) -> list[Transaction]:
+        if self._transactions is None:
+            self._transactions = self._table.to_transactions()
+        return self._transactions
+
+    @ transactions.setter
+    def transactions(self, transactions: list[Transaction]):
+        self._transactions = transactions
+        self._table = None
+        self._category_index = None
+        self._range_index = None
+        self._rollup = None
+
+    @ property
+    def table(self) -> TransactionTable:
+        if self._table is None:
+            self._table = TransactionTable.from_transactions(
+                self._transactions)
+        return self._table
+
+    @timed("core.fingerprint")
+    def fingerprint(self, start: datetime.date, end: datetime.date, period: int):
+        table = self.table
+        index = self.range_index()
+        (lo, hi) = index.slice(start, end)
+        window = table.select(index.order[lo:hi])
+        opening_balance = index.opening_balance(start)
+        pairs = [(category, sub_category)
+                 for category, sub_categories in self.category_index().groups.items()
+                 for sub_category in sub_categories]
+
+        digest = hashlib.sha256()
+        digest.update(repr((period, opening_balance, sorted(pairs))).encode())
+        digest.update(window.occured_at.tobytes())
+        digest.update(window.amount.tobytes())
+        for codes, values in ((window.category, table.categories),
+                              (window.sub_category, table.sub_categories),
+                              (window.label, table.labels)):
+            digest.update("\0".join(values[c] for c in codes.tolist()).encode())
+        return digest.hexdigest()
+
+    def category_index(self) -> CategoryIndex:
+        if self._category_index is None:
+            self._category_index = CategoryIndex(self.table)
+        return self._category_index
+
+    def range_index(self) -> RangeIndex:
+        if self._range_index is None:
+            self._range_index = RangeIndex(self.table, self.initial_balance)
+        return self._range_index
+
+    def rollup(self) -> PeriodRollup:
+        if self._rollup is None:
+            self._rollup = PeriodRollup.from_account(self)
+        return self._rollup
+
+    def snapshot(self):
+        return Account(self.initial_balance, self.imported_at, table=self.table)
 
     @ staticmethod
-    def parse_import(rows):
-        final_balance = float(rows[0][2])
+    @timed("core.parse_import")
+    def parse_import(rows, rules=None):
+        columns = list(zip(*rows[IMPORT_HEADER_ROWS:]))[:IMPORT_COLUMNS]
+        return Account.parse_import_columns(rows[0], columns, rules)
+
+    @ staticmethod
+    def parse_import_columns(header, columns, rules=None):
+        final_balance = float(header[2])
         imported_at = parse_french_date(
-            rows[0][1].replace("Solde au ", ""), "/")
-        transactions = list(map(Transaction.parse_import, rows[3:]))
-        transactions.reverse()
-        total_amount = sum(map(lambda t: t.amount, transactions))
+            header[1].replace("Solde au ", ""), "/")
+        if len(columns) < IMPORT_COLUMNS:
+            columns = [[] for _ in range(IMPORT_COLUMNS)]
+        table = TransactionTable.parse_import([c[::-1] for c in columns])
+        if rules is not None:
+            table = rules.categorize(table)
+        total_amount = sum(table.amount.tolist())
         initial_balance = final_balance - total_amount
-        return Account(initial_balance, imported_at, transactions)
+        return Account(initial_balance, imported_at, table=table)
 
     @ staticmethod
-    def parse_current(rows):
-        imported_at = parse_french_date(rows[0][7], "/")
-        all_transactions = list(map(Transaction.parse_current, rows[1:]))
-
-        (initials, transactions) = partition(
-            all_transactions, Transaction.is_initial)
+    @timed("core.read_import")
+    def read_import(filepath, rules=None):
+        return Account.parse_import_columns(*read_import_columns(filepath), rules)
 
-        try:
-            initial_balance = initials[0].amount
-        except IndexError:
+    @ staticmethod
+    @timed("core.parse_current")
+    def parse_current(rows, chunk_size=CHUNK_SIZE):
+        rows = iter(rows)
+        imported_at = parse_french_date(next(rows)[7], "/")
+        initial_balance = None
+        builder = TransactionTableBuilder()
+
+        for chunk in chunked(rows, chunk_size):
+            transactions = [r for r in chunk if r[4] != "initial"]
+            if initial_balance is None and len(transactions) < len(chunk):
+                initial = next(r for r in chunk if r[4] == "initial")
+                initial_balance = float(initial[5].replace(",", "."))
+            builder.append_current(transactions)
+
+        if initial_balance is None:
             initial_balance = 0.0
 
-        return Account(initial_balance, imported_at, transactions)
+        return Account(initial_balance, imported_at, table=builder.build())
 
+    @ staticmethod
+    @timed("core.read_current")
+    def read_current(filepath, chunk_size=CHUNK_SIZE):
+        account = Account.load_cache(filepath)
+        if account is None:
+            account = Account.parse_current(iter_csv_file(filepath), chunk_size)
+            account.save_cache(filepath)
+        return Journal(filepath).replay(account)
+
+    @timed("core.write_current")
+    def write_current(self, filepath):
+        journal = Journal(filepath)
+        journal.set_aside()
+        write_csv_file(filepath, self.to_export())
+        self.save_cache(filepath)
+        journal.discard()
+
+    def append_current(self, filepath, previous):
+        return Journal(filepath).append(previous, self)
+
+    @ staticmethod
+    @timed("core.load_cache")
+    def load_cache(filepath):
+        try:
+            with np.load(ledger_cache_filepath(filepath)) as arrays:
+                if not np.array_equal(arrays["signature"], file_signature(filepath)):
+                    return None
+                table = TransactionTable.from_arrays(arrays)
+                initial_balance = float(arrays["initial_balance"])
+                imported_at = arrays["imported_at"].item()
+        except Exception:
+            # A truncated or foreign cache must never block reading the ledger
+            return None
+
+        return Account(initial_balance, imported_at, table=table)
+
+    @timed("core.save_cache")
+    def save_cache(self, filepath):
+        cache_filepath = ledger_cache_filepath(filepath)
+        tmp_filepath = cache_filepath + ".tmp"
+        try:
+            with open(tmp_filepath, mode="wb") as file:
+                np.savez(file,
+                         signature=file_signature(filepath),
+                         initial_balance=self.initial_balance,
+                         imported_at=np.datetime64(self.imported_at, "D"),
+                         **self.table.to_arrays())
+            os.replace(tmp_filepath, cache_filepath)
+        except OSError:
+            pass
+
+    @timed("core.to_export")
     def to_export(self):
         header = ["Ordre",
                   "Date",
@@ -262,14 +1098,14 @@ class Account:
                   "",
                   make_french_date(self.imported_at, "/")]
 
-        initial_date = self.transactions[0].occured_at - DAY_DELTA
+        table = self.table
+        initial_date = table.occured_at[0].item() - DAY_DELTA
         initial = Transaction.make_initial(initial_date, self.initial_balance)
         initial_row = [0, *initial.to_export()]
-        enumerated_transactions = enumerate(self.transactions)
-        rows = [[t[0] + 1, *t[1].to_export()] for t in enumerated_transactions]
-        return [header, initial_row, *rows]
+        return [header, initial_row, *table.to_rows()]
 
-    def merge(self, other):
+    @timed("core.merge")
+    def merge(self, other, matcher=None):
         if self.imported_at > other.imported_at:
             raise NotImplementedError
 
@@ -277,76 +1113,371 @@ class Account:
         imported_at = other.imported_at
         last_occured_at = self.ended_at()
 
-        old_transactions = [t_self for t_self in self.transactions if not some(
-            other.transactions, lambda t_other: t_other.is_same(t_self))]
-
-        updated_transactions = [t_other for t_other in other.transactions if some(
-            self.transactions, lambda t_self: t_self.is_same(t_other))]
-
-        new_transactions = [t_other for t_other in other.transactions if t_other.occured_at > last_occured_at and not some(
-            self.transactions, lambda t_self: t_self.is_same(t_other))]
+        self_keys = Counter(map(Transaction.key, self.transactions))
+        other_keys = Counter(map(Transaction.key, other.transactions))
+        same_keys = self_keys & other_keys
+
+        old_transactions = []
+        unmatched = same_keys.copy()
+        for t_self in self.transactions:
+            key = t_self.key()
+            if unmatched[key] > 0:
+                unmatched[key] -= 1
+            else:
+                old_transactions.append(t_self)
+
+        # Every import copy of a known transaction is kept with the surplus of
+        # current copies, identical transactions end with the most copies seen
+        other_matched = [t_other.key() in self_keys for t_other in other.transactions]
+
+        if matcher is not None:
+            # Only transactions the import covers but did not list can have
+            # been rebooked, under another label, shortly after the overlap
+            coverage_start = other.started_at()
+            overlap_end = last_occured_at + datetime.timedelta(days=matcher.window)
+            currents = [idx for idx, t_self in enumerate(old_transactions)
+                        if t_self.occured_at >= coverage_start]
+            imports = [idx for idx, t_other in enumerate(other.transactions)
+                       if not other_matched[idx]
+                       and last_occured_at < t_other.occured_at <= overlap_end]
+            pairs = matcher.match([old_transactions[idx] for idx in currents],
+                                  [other.transactions[idx] for idx in imports])
+            duplicates = {currents[i] for i, _ in pairs}
+            for _, j in pairs:
+                other_matched[imports[j]] = True
+            old_transactions = [t_self for idx, t_self in enumerate(old_transactions)
+                                if idx not in duplicates]
+
+        updated_transactions = []
+        new_transactions = []
+        for t_other, matched in zip(other.transactions, other_matched):
+            if matched:
+                updated_transactions.append(t_other)
+            elif t_other.occured_at > last_occured_at:
+                new_transactions.append(t_other)
 
         transactions = old_transactions + updated_transactions + new_transactions
 
         return Account(initial_balance, imported_at, transactions)
 
     def occured_at(self):
-        return [t.occured_at for t in self.transactions]
+        return self.table.occured_at.tolist()
 
+    @timed("core.balance")
     def balance(self):
-        balance = [0] * (len(self.transactions) + 1)
-        balance[0] = self.initial_balance
-        for idx, transaction in enumerate(self.transactions):
-            balance[idx + 1] = balance[idx] + transaction.amount
-
-        return group_by(self.occured_at(), balance[1:])
+        amounts = np.concatenate(([self.initial_balance], self.table.amount))
+        balance = np.cumsum(amounts)
+        return group_by(self.occured_at(), balance[1:].tolist())
 
+    @timed("core.gain")
     def gain(self):
-        return group_by(self.occured_at(), [max(t.amount, 0) for t in self.transactions])
+        gain = np.clip(self.table.amount, 0, None)
+        return group_by(self.occured_at(), gain.tolist())
 
+    @timed("core.loss")
     def loss(self):
-        return group_by(self.occured_at(), [max(-t.amount, 0) for t in self.transactions])
+        loss = np.clip(-self.table.amount, 0, None)
+        return group_by(self.occured_at(), loss.tolist())
 
     def started_at(self):
         try:
-            return self.transactions[0].occured_at
+            return self.table.occured_at[0].item()
         except IndexError:
             return self.imported_at
 
     def ended_at(self):
         try:
-            return self.transactions[-1].occured_at
+            return self.table.occured_at[-1].item()
         except IndexError:
             return self.imported_at
 
-    def by_category(self):
-        transactions = {}
-        for t in self.transactions:
+    def by_category(self, start=None, end=None):
+        return self.category_index().by_category(start, end)
+
+    def by_sub_category(self, start=None, end=None):
+        return self.category_index().by_sub_category(start, end)
+
+
+class Journal:
+    filepath: str
+    journal_filepath: str
+    compacting_filepath: str
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.journal_filepath = journal_filepath(filepath)
+        self.compacting_filepath = self.journal_filepath + ".compacting"
+
+    def signature(self):
+        return ["journal", str(JOURNAL_VERSION),
+                *map(str, file_signature(self.filepath)[1:].tolist())]
+
+    def exists(self):
+        return os.path.exists(self.journal_filepath)
+
+    def set_aside(self):
+        try:
+            os.replace(self.journal_filepath, self.compacting_filepath)
+        except FileNotFoundError:
+            pass
+
+    def recover(self):
+        # A journal set aside by an interrupted compaction still belongs to
+        # the record if it was not replaced yet, otherwise it was folded in
+        try:
+            rows = read_csv_file(self.compacting_filepath)
+        except OSError:
+            return
+        if len(rows) > 0 and rows[0] == self.signature():
+            os.replace(self.compacting_filepath, self.journal_filepath)
+        else:
+            os.remove(self.compacting_filepath)
+
+    def read(self):
+        self.recover()
+        try:
+            rows = read_csv_file(self.journal_filepath)
+        except OSError:
+            return ([], False)
+        if len(rows) == 0:
+            return ([], False)
+        if rows[0] != self.signature():
+            # The current record changed after these transactions were
+            # journaled, they are kept aside rather than silently dropped
+            orphan_filepath = self.orphan()
+            raise ValueError(f"{self.filepath} was modified before its merge journal was "
+                             f"compacted, the journaled transactions were moved to "
+                             f"{orphan_filepath} and must be merged again")
+        rows = rows[1:]
+
+        entries = []
+        position = 0
+        while position < len(rows):
+            header = rows[position]
             try:
-                transactions[t.category][t.occured_at] += [t.amount]
-            except KeyError:
-                try:
-                    transactions[t.category][t.occured_at] = [t.amount]
-                except KeyError:
-                    transactions[t.category] = {t.occured_at: [t.amount]}
-
-        return transactions
-
-    def by_sub_category(self):
-        transactions = {}
-        for t in self.transactions:
+                imported_at = parse_french_date(header[1], "/")
+                start = int(header[2])
+                count = int(header[3])
+            except (IndexError, ValueError):
+                break
+            transactions = rows[position + 1:position + 1 + count]
+            # An entry cut by a crash during its append has no commit row
+            if rows[position + 1 + count:position + 2 + count] != [["commit", str(count)]]:
+                break
+            entries.append((imported_at, start, transactions))
+            position += 2 + count
+        return (entries, position == len(rows))
+
+    def entries(self):
+        return self.read()[0]
+
+    @timed("core.journal_replay")
+    def replay(self, account: Account):
+        self.recover()
+        entries = self.entries() if self.exists() else []
+        if len(entries) == 0:
+            return account
+
+        table = account.table
+        for imported_at, start, rows in entries:
+            table = table.select(slice(0, start)).concatenate(
+                TransactionTable.parse_current(rows))
+        return Account(account.initial_balance, imported_at, table=table)
+
+    @timed("core.journal_append")
+    def append(self, previous: Account, account: Account):
+        if account.initial_balance != previous.initial_balance:
+            account.write_current(self.filepath)
+            return len(account.table)
+
+        start = previous.table.first_difference(account.table)
+        rows = account.table.select(slice(start, None)).to_rows(start + 1)
+
+        (entries, clean) = self.read()
+        if not clean:
+            write_csv_file(self.journal_filepath,
+                           [self.signature(), *self.to_rows(entries)])
+        append_csv_file(self.journal_filepath,
+                        self.to_rows([(account.imported_at, start, rows)]))
+        return len(rows)
+
+    @ staticmethod
+    def to_rows(entries):
+        return [row for imported_at, start, rows in entries
+                for row in (["entry", make_french_date(imported_at, "/"), start, len(rows)],
+                            *rows,
+                            ["commit", len(rows)])]
+
+    @timed("core.journal_compact")
+    def compact(self):
+        self.recover()
+        if not self.exists():
+            return
+        Account.read_current(self.filepath).write_current(self.filepath)
+
+    def orphan(self):
+        orphan_filepath = self.journal_filepath + ".orphan"
+        suffix = 1
+        while os.path.exists(orphan_filepath):
+            orphan_filepath = f"{self.journal_filepath}.orphan.{suffix}"
+            suffix += 1
+        os.replace(self.journal_filepath, orphan_filepath)
+        return orphan_filepath
+
+    def discard(self):
+        for filepath in (self.journal_filepath, self.compacting_filepath):
             try:
-                transactions[t.category][t.sub_category][t.occured_at] += [t.amount]
-            except KeyError:
-                try:
-                    transactions[t.category][t.sub_category][t.occured_at] = [
-                        t.amount]
-                except KeyError:
+                os.remove(filepath)
+            except FileNotFoundError:
+                pass
+
+    def snapshot(self, snapshot_filepath):
+        # The current record may be edited in place by other tools, the
+        # snapshot is an independent copy keeping its mtime, so the copied
+        # journal still matches it
+        self.recover()
+        tmp_filepath = snapshot_filepath + ".tmp"
+        shutil.copy2(self.filepath, tmp_filepath)
+        os.replace(tmp_filepath, snapshot_filepath)
+
+        snapshot = Journal(snapshot_filepath)
+        if self.exists():
+            shutil.copy2(self.journal_filepath, tmp_filepath)
+            os.replace(tmp_filepath, snapshot.journal_filepath)
+        else:
+            snapshot.discard()
+
+
+class AccountSeries:
+    dates: list
+    balance: np.ndarray
+    gain: np.ndarray
+    loss: np.ndarray
+    categories: dict[str, dict[str, np.ndarray]]
+
+    def __init__(self, dates, balance, gain, loss, categories):
+        self.dates = dates
+        self.balance = balance
+        self.gain = gain
+        self.loss = loss
+        self.categories = categories
+
+    @ staticmethod
+    @timed("core.account_series")
+    def from_account(account: Account, dates):
+        range_index = account.range_index()
+        category_index = account.category_index()
+        categories = {category: {sub_category: category_index.series(dates, category, sub_category)
+                                 for sub_category in sub_categories}
+                      for category, sub_categories in category_index.groups.items()}
+        return AccountSeries(dates,
+                             range_index.balance_series(dates),
+                             range_index.gain_series(dates),
+                             range_index.loss_series(dates),
+                             categories)
+
+    @ staticmethod
+    def consolidate(dates, series: list):
+        categories = {}
+        for s in series:
+            for category, sub_categories in s.categories.items():
+                consolidated = categories.setdefault(category, {})
+                for sub_category, values in sub_categories.items():
                     try:
-                        transactions[t.category][t.sub_category] = {
-                            t.occured_at: [t.amount]}
+                        consolidated[sub_category] = consolidated[sub_category] + values
                     except KeyError:
-                        transactions[t.category] = {
-                            t.sub_category: {t.occured_at: [t.amount]}}
+                        consolidated[sub_category] = values
+
+        zeros = np.zeros(len(dates))
+        return AccountSeries(dates,
+                             sum((s.balance for s in series), zeros),
+                             sum((s.gain for s in series), zeros),
+                             sum((s.loss for s in series), zeros),
+                             categories)
+
+    def category(self, category):
+        return sum(self.categories[category].values(), np.zeros(len(self.dates)))
+
+    def slice(self, start: datetime.date, end: datetime.date):
+        # Dates are consecutive days, see make_linear_date
+        lo = max((start - self.dates[0]).days, 0)
+        hi = max((end - self.dates[0]).days + 1, lo)
+        categories = {category: {sub_category: values[lo:hi]
+                                 for sub_category, values in sub_categories.items()}
+                      for category, sub_categories in self.categories.items()}
+        return AccountSeries(self.dates[lo:hi], self.balance[lo:hi], self.gain[lo:hi],
+                             self.loss[lo:hi], categories)
+
+
+class PortfolioSeries:
+    total: AccountSeries
+    accounts: dict[str, AccountSeries]
+
+    def __init__(self, total: AccountSeries, accounts: dict[str, AccountSeries]):
+        self.total = total
+        self.accounts = accounts
+
+    def slice(self, start: datetime.date, end: datetime.date):
+        return PortfolioSeries(self.total.slice(start, end),
+                               {name: s.slice(start, end) for name, s in self.accounts.items()})
+
+
+class Portfolio:
+    accounts: dict[str, Account]
+
+    def __init__(self, accounts: dict[str, Account]):
+        self.accounts = accounts
+
+    @ staticmethod
+    def account_names(filepaths):
+        # Records are named after their file, records sharing a file name
+        # such as bank1/current.csv and bank2/current.csv get their directory
+        filepaths = list(dict.fromkeys(map(os.path.abspath, filepaths)))
+        stems = [os.path.splitext(os.path.basename(filepath))[0]
+                 for filepath in filepaths]
+        counts = Counter(stems)
+        names = {}
+        for filepath, stem in zip(filepaths, stems):
+            name = stem if counts[stem] == 1 else \
+                f"{os.path.basename(os.path.dirname(filepath))}/{stem}"
+            unique = name
+            suffix = 2
+            while unique in names.values():
+                unique = f"{name} ({suffix})"
+                suffix += 1
+            names[filepath] = unique
+        return names
+
+    @ staticmethod
+    def read_current(filepaths):
+        names = Portfolio.account_names(filepaths)
+        return Portfolio({name: Account.read_current(filepath)
+                          for filepath, name in names.items()})
+
+    def started_at(self):
+        return min(account.started_at() for account in self.accounts.values())
+
+    def ended_at(self):
+        return max(account.ended_at() for account in self.accounts.values())
+
+    def fingerprint(self, start: datetime.date, end: datetime.date, period: int):
+        digest = hashlib.sha256()
+        for name, account in self.accounts.items():
+            digest.update(name.encode())
+            digest.update(account.fingerprint(start, end, period).encode())
+        return digest.hexdigest()
+
+    @timed("core.portfolio_aggregate")
+    def aggregate(self, dates, workers=1):
+        names = list(self.accounts)
+        if workers <= 1 or len(names) <= 1:
+            series = [AccountSeries.from_account(self.accounts[name], dates)
+                      for name in names]
+        else:
+            snapshots = [self.accounts[name].snapshot() for name in names]
+            with ProcessPoolExecutor(max_workers=min(workers, len(names))) as executor:
+                series = list(executor.map(AccountSeries.from_account,
+                                           snapshots, repeat(dates)))
 
-        return transactions
+        return PortfolioSeries(AccountSeries.consolidate(dates, series),
+                               dict(zip(names, series)))
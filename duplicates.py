@@ -0,0 +1,116 @@
+import os
+import re
+import unicodedata
+from difflib import SequenceMatcher
+
+from core import *
+from timing import timed
+
+DUPLICATES_SUFFIX = ".duplicates.csv"
+DUPLICATES_HEADER = ["Import", "Date", "Libelle", "Date importee", "Libelle importe",
+                     "Montant", "Score"]
+
+FUZZY_WINDOW = 3
+FUZZY_THRESHOLD = 0.75
+
+SEPARATOR_PATTERN = re.compile(r"[\W_]+")
+
+
+def duplicates_filepath(filepath):
+    return filepath + DUPLICATES_SUFFIX
+
+
+def normalize_label(label):
+    # Banks reformat labels between exports: accents, case, punctuation,
+    # card numbers and value dates change while the merchant stays the same
+    label = unicodedata.normalize("NFKD", label)
+    label = "".join(char for char in label if not unicodedata.combining(char))
+    return " ".join(token for token in SEPARATOR_PATTERN.split(label.casefold())
+                    if token != "" and not token.isdigit())
+
+
+class DuplicateMatch:
+    current: Transaction
+    imported: Transaction
+    score: float
+
+    def __init__(self, current, imported, score):
+        self.current = current
+        self.imported = imported
+        self.score = score
+
+    def to_row(self, imported_at):
+        return [make_french_date(imported_at, "/"),
+                make_french_date(self.current.occured_at), self.current.label,
+                make_french_date(self.imported.occured_at), self.imported.label,
+                encode_french_amounts([self.current.amount])[0], f"{self.score:.2f}"]
+
+
+class DuplicateMatcher:
+    window: int
+    threshold: float
+    matches: list[DuplicateMatch]
+    memo: dict[str, str]
+
+    def __init__(self, window=FUZZY_WINDOW, threshold=FUZZY_THRESHOLD):
+        self.window = window
+        self.threshold = threshold
+        self.matches = []
+        self.memo = {}
+
+    def normalize(self, label):
+        try:
+            return self.memo[label]
+        except KeyError:
+            normalized = self.memo[label] = normalize_label(label)
+            return normalized
+
+    def similarity(self, label, other_label):
+        label = self.normalize(label)
+        other_label = self.normalize(other_label)
+        if label == other_label:
+            return 1.0
+        return SequenceMatcher(None, label, other_label, autojunk=False).ratio()
+
+    @timed("duplicates.match")
+    def match(self, currents: list[Transaction], imports: list[Transaction]):
+        # Only transactions with the same amount and close dates are compared,
+        # each amount is a blocking bucket of current transactions
+        buckets = {}
+        for i, t_current in enumerate(currents):
+            buckets.setdefault(round(t_current.amount * 100), []).append(i)
+
+        candidates = []
+        for j, t_import in enumerate(imports):
+            for i in buckets.get(round(t_import.amount * 100), ()):
+                t_current = currents[i]
+                days = abs((t_import.occured_at - t_current.occured_at).days)
+                if days > self.window:
+                    continue
+                score = self.similarity(t_current.label, t_import.label)
+                if score >= self.threshold:
+                    candidates.append((-score, days, i, j))
+
+        # Best scores first, each transaction is matched at most once
+        pairs = []
+        used_currents = set()
+        used_imports = set()
+        for score, _, i, j in sorted(candidates):
+            if i in used_currents or j in used_imports:
+                continue
+            used_currents.add(i)
+            used_imports.add(j)
+            pairs.append((i, j))
+            self.matches.append(DuplicateMatch(currents[i], imports[j], -score))
+        return pairs
+
+    def to_rows(self, imported_at):
+        return [match.to_row(imported_at) for match in self.matches]
+
+    def write(self, current_filepath, imported_at):
+        # The report is an audit trail, each merge appends its own block
+        filepath = duplicates_filepath(current_filepath)
+        if len(self.matches) > 0:
+            header = [] if os.path.exists(filepath) else [DUPLICATES_HEADER]
+            append_csv_file(filepath, header + self.to_rows(imported_at))
+        return filepath
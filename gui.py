@@ -30,8 +30,8 @@ class FilePickerFrame(tk.Frame):
 
         filetypes = (
             ('CSV Files', '*.csv'),
-            ('CSV Files', '*.xls'),
-            ('CSV Files', '*.xlsx'),
+            ('Excel Files', '*.xls'),
+            ('Excel Files', '*.xlsx'),
             ('All files', '*.*')
         )
 
@@ -65,32 +65,63 @@ class CheckFrame(tk.Frame):
         return self.var_check.get()
 
 
+class SpinFrame(tk.Frame):
+    var_spin: tk.Variable
+    label: tk.Label
+    spin: ttk.Spinbox
+
+    def __init__(self, root, name, initial=1, maximum=64):
+        super().__init__(root)
+        self.var_spin = tk.IntVar(root, value=initial)
+        self.label = ttk.Label(self, text=name)
+        self.spin = ttk.Spinbox(self, from_=1, to=maximum, width=4,
+                                textvariable=self.var_spin)
+
+        self.label.pack(side=tk.LEFT)
+        self.spin.pack(side=tk.RIGHT)
+
+    def value(self):
+        return self.var_spin.get()
+
+
 class ConfigurationBarFrame(tk.Frame):
     last_month_check: CheckFrame
     backup_check: CheckFrame
+    workers_spin: SpinFrame
 
     def __init__(self, root):
         super().__init__(root)
         self.last_month_check = CheckFrame(self, "Only last month")
         self.backup_check = CheckFrame(self, "Backup current data")
+        self.workers_spin = SpinFrame(self, "Workers",
+                                      initial=os.cpu_count() or 1)
         self.last_month_check.pack(side=tk.LEFT)
         self.backup_check.pack(side=tk.LEFT)
+        self.workers_spin.pack(side=tk.LEFT)
 
 
 class ActionBarFrame(tk.Frame):
     button_merge: tk.Button
     button_synthetize: tk.Button
+    button_consolidate: tk.Button
+    button_cancel: tk.Button
 
-    def __init__(self, root, on_merge, on_synthetize):
+    def __init__(self, root, on_merge, on_synthetize, on_consolidate, on_cancel):
         super().__init__(root)
 
         self.button_merge = ttk.Button(self, text="Merge records",
                                        command=on_merge)
         self.button_synthetize = ttk.Button(self, text="Synthetize records",
                                             command=on_synthetize)
+        self.button_consolidate = ttk.Button(self, text="Consolidate records",
+                                             command=on_consolidate)
+        self.button_cancel = ttk.Button(self, text="Cancel",
+                                        command=on_cancel, state=tk.DISABLED)
 
         self.button_merge.pack(side=tk.LEFT)
+        self.button_cancel.pack(side=tk.RIGHT)
         self.button_synthetize.pack(side=tk.RIGHT)
+        self.button_consolidate.pack(side=tk.RIGHT)
 
 
 class Window:
@@ -101,7 +132,7 @@ class Window:
     config_bar: ConfigurationBarFrame
     action_bar: ActionBarFrame
 
-    def __init__(self, on_merge, on_synthetize, on_quit):
+    def __init__(self, on_merge, on_synthetize, on_consolidate, on_cancel, on_quit):
         self.root = tk.Tk()
         self.root.title("Select a transactions record")
 
@@ -124,5 +155,14 @@ class Window:
         self.progress_bar.pack(fill=tk.BOTH)
 
         self.action_bar = ActionBarFrame(self.root, on_merge=on_merge,
-                                         on_synthetize=on_synthetize)
+                                         on_synthetize=on_synthetize,
+                                         on_consolidate=on_consolidate,
+                                         on_cancel=on_cancel)
         self.action_bar.pack(pady=10)
+
+    def select_current_files(self):
+        filenames = fd.askopenfilenames(
+            title="Open current records",
+            initialdir=os.getcwd(),
+            filetypes=(('CSV Files', '*.csv'), ('All files', '*.*')))
+        return list(filenames) if filenames else []
@@ -0,0 +1,123 @@
+import queue
+import threading
+import traceback
+
+POLL_INTERVAL = 50
+
+
+class Cancelled(Exception):
+    pass
+
+
+class JobError(Exception):
+    title: str
+    error: Exception
+
+    def __init__(self, title, error):
+        super().__init__(f"{title}: {error}")
+        self.title = title
+        self.error = error
+
+
+class Job:
+    name: str
+    target: callable
+    on_done: callable
+    on_error: callable
+    _cancelled: threading.Event
+    _events: queue.Queue
+
+    def __init__(self, name, target, on_done, on_error, events):
+        self.name = name
+        self.target = target
+        self.on_done = on_done
+        self.on_error = on_error
+        self._cancelled = threading.Event()
+        self._events = events
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self.is_cancelled():
+            raise Cancelled(self.name)
+
+    def report(self, done, total):
+        self.check()
+        self._events.put(("progress", self, (done, total)))
+
+
+class JobQueue:
+    root: object
+    on_progress: callable
+    on_idle: callable
+    pending: queue.Queue
+    events: queue.Queue
+    jobs: list[Job]
+    thread: threading.Thread
+
+    def __init__(self, root, on_progress=None, on_idle=None):
+        self.root = root
+        self.on_progress = on_progress if on_progress is not None else lambda *_: None
+        self.on_idle = on_idle if on_idle is not None else lambda: None
+        self.pending = queue.Queue()
+        self.events = queue.Queue()
+        self.jobs = []
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.root.after(POLL_INTERVAL, self._poll)
+
+    def submit(self, name, target, on_done=None, on_error=None):
+        job = Job(name, target, on_done, on_error, self.events)
+        self.jobs.append(job)
+        self.pending.put(job)
+        return job
+
+    def cancel(self):
+        for job in self.jobs:
+            job.cancel()
+
+    def is_busy(self):
+        return len(self.jobs) > 0
+
+    def _run(self):
+        while True:
+            job = self.pending.get()
+            if job.is_cancelled():
+                self.events.put(("cancelled", job, None))
+                continue
+
+            try:
+                result = job.target(job)
+                self.events.put(("done", job, result))
+            except Cancelled:
+                self.events.put(("cancelled", job, None))
+            except Exception as e:
+                traceback.print_exception(e)
+                self.events.put(("error", job, e))
+
+    def _poll(self):
+        while True:
+            try:
+                (kind, job, payload) = self.events.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "progress":
+                self.on_progress(job, *payload)
+                continue
+
+            self.jobs.remove(job)
+            if kind == "done" and job.on_done is not None:
+                job.on_done(payload)
+            elif kind == "error" and job.on_error is not None:
+                job.on_error(payload)
+
+            if not self.is_busy():
+                self.on_idle()
+
+        self.root.after(POLL_INTERVAL, self._poll)
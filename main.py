@@ -1,8 +1,34 @@
-import matplotlib
+import time
+
+STARTED_AT = time.perf_counter()
+
+import argparse
+import sys
 
 from app import App
 
+STARTUP_TARGET = 0.25
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Merge bank exports into current records and render synthesis reports")
+    parser.add_argument("--no-prewarm", action="store_true",
+                        help="load plotting modules on first synthesis instead of in the background")
+    parser.add_argument("--startup-time", action="store_true",
+                        help="print the time taken to show the window")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    matplotlib.use('agg')
-    app = App()
+    args = parse_args(sys.argv[1:])
+    app = App(prewarm=not args.no_prewarm)
+
+    if args.startup_time:
+        app.window.root.update()
+        elapsed = time.perf_counter() - STARTED_AT
+        status = "ok" if elapsed <= STARTUP_TARGET else "over target"
+        print(f"Window shown in {elapsed * 1e3:.0f} ms "
+              f"(target {STARTUP_TARGET * 1e3:.0f} ms, {status})", file=sys.stderr)
+
     app.window.root.mainloop()
@@ -1,12 +1,163 @@
 
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
 import matplotlib.colors as mcolors
 import matplotlib.dates as mdates
 import matplotlib.figure as fig
 import matplotlib.pyplot as plt
+import matplotlib.ticker as mticker
 import numpy as np
 from matplotlib.backends.backend_pdf import PdfPages
 
+import timing
 from core import *
+from timing import span, timed
+
+
+SYNTHESIS_CACHE_FILENAME = ".synthesis_cache.json"
+PAGE_SIZE = (8.3, 11.7)
+REPORT_PERIODS = {"month": 1, "quarter": 7, "year": 30}
+REPORT_TOTALS = {"quarter": ("month", "week"), "year": ("quarter", "month")}
+
+
+class RenderCache:
+    directory: str
+    filepath: str
+    fingerprints: dict[str, str]
+
+    def __init__(self, directory=".", name=None):
+        self.directory = directory
+        # Accounts rendered into the same directory each keep their own cache
+        filename = SYNTHESIS_CACHE_FILENAME if name is None \
+            else f".{name}{SYNTHESIS_CACHE_FILENAME}"
+        self.filepath = os.path.join(directory, filename)
+        try:
+            with open(self.filepath, encoding="utf-8") as file:
+                self.fingerprints = json.load(file)
+        except (OSError, ValueError):
+            self.fingerprints = {}
+
+    def is_fresh(self, filename, fingerprint):
+        return os.path.exists(os.path.join(self.directory, filename)) and \
+            self.fingerprints.get(filename) == fingerprint
+
+    def update(self, filename, fingerprint):
+        self.fingerprints[filename] = fingerprint
+        self.save()
+
+    def save(self):
+        tmp_filepath = self.filepath + ".tmp"
+        with open(tmp_filepath, mode="w", encoding="utf-8") as file:
+            json.dump(self.fingerprints, file, indent=1, sort_keys=True)
+        os.replace(tmp_filepath, self.filepath)
+
+
+def synthesis_filename(start: datetime.date, end: datetime.date, name=None):
+    filename = f"{start.isoformat()}_{end.isoformat()}_{1}_days_account_synthesis.pdf"
+    return filename if name is None else f"{name}_{filename}"
+
+
+def portfolio_filename(start: datetime.date, end: datetime.date):
+    return f"{start.isoformat()}_{end.isoformat()}_{1}_days_portfolio_synthesis.pdf"
+
+
+class SeriesBundle:
+    dates: list
+    aggregated: list[tuple[str, np.ndarray]]
+    cumulated: list[tuple[str, np.ndarray]]
+    positive: list[tuple[str, np.ndarray]]
+    negative: list[tuple[str, np.ndarray]]
+
+    def __init__(self, dates, series: dict):
+        self.dates = dates
+        self.aggregated = list(series.items())
+        self.cumulated = [(label, cumulate(s)) for label, s in self.aggregated]
+        self.positive = [c for c in self.cumulated if c[1].max() > 0]
+        self.negative = [c for c in self.cumulated if c[1].max() <= 0]
+
+    @ staticmethod
+    def from_amounts(amount_by_category, dates):
+        return SeriesBundle(dates, {label: aggregate(dates, amounts)
+                                    for label, amounts in amount_by_category.items()})
+
+    @ staticmethod
+    def from_series(series: AccountSeries, category=None):
+        if category is None:
+            values = {c: series.category(c) for c in series.categories}
+        else:
+            values = series.categories[category]
+        return SeriesBundle(series.dates, values)
+
+    @ staticmethod
+    @timed("plot.series_bundle")
+    def from_index(index: CategoryIndex, dates, category=None):
+        if category is None:
+            series = {c: index.series(dates, c) for c in index.groups}
+        else:
+            series = {s: index.series(dates, category, s)
+                      for s in index.groups[category]}
+        return SeriesBundle(dates, series)
+
+
+class PageTemplates:
+    synthesis: fig.Figure
+    synthesis_axes: list[plt.Axes]
+    overall: fig.Figure
+    overall_axes: list[plt.Axes]
+    detail: fig.Figure
+    detail_axes: list[plt.Axes]
+    breakdown: fig.Figure
+    breakdown_axes: list[plt.Axes]
+
+    def __init__(self):
+        self.synthesis = fig.Figure(figsize=PAGE_SIZE)
+        self.synthesis_axes = self.synthesis.subplots(4, 1, sharex=True)
+        self.overall = fig.Figure(figsize=PAGE_SIZE)
+        self.overall_axes = self.overall.subplots(2, 1)
+        self.detail = fig.Figure(figsize=PAGE_SIZE)
+        self.detail_axes = self.detail.subplots(3, 1)
+        self.breakdown = fig.Figure(figsize=PAGE_SIZE)
+        self.breakdown_axes = self.breakdown.subplots(3, 1, sharex=True)
+
+
+_templates = threading.local()
+
+
+def page_templates() -> PageTemplates:
+    try:
+        return _templates.pages
+    except AttributeError:
+        _templates.pages = PageTemplates()
+        return _templates.pages
+
+
+def reset_ax(ax: plt.Axes, dates=True):
+    for artist in [*ax.lines, *ax.collections, *ax.patches, *ax.texts]:
+        artist.remove()
+    ax.containers.clear()
+    ax.set_prop_cycle(None)
+
+    ax.set_title("")
+    ax.set_xlabel("")
+    ax.set_ylabel("")
+    ax.grid(False)
+    ax.set_aspect("auto")
+    ax.set_frame_on(True)
+    ax.relim()
+    ax.set_ylim(0, 1)
+    if not dates:
+        ax.set_xlim(0, 1)
+    ax.set_autoscale_on(True)
+
+    ax.yaxis.set_major_locator(mticker.AutoLocator())
+    ax.yaxis.set_major_formatter(mticker.ScalarFormatter())
+    if not dates:
+        ax.xaxis.set_major_locator(mticker.AutoLocator())
+        ax.xaxis.set_major_formatter(mticker.ScalarFormatter())
 
 
 def make_linear_trend(dates, data):
@@ -18,7 +169,7 @@ def make_linear_trend(dates, data):
 
 
 def render_fig(fig: fig.Figure, title=None, date: datetime.date = None, pdf=None):
-    plt.gcf().set_size_inches(8.3, 11.7)
+    fig.set_size_inches(*PAGE_SIZE)
     dated_title = None
 
     if title is not None:
@@ -32,11 +183,11 @@ def render_fig(fig: fig.Figure, title=None, date: datetime.date = None, pdf=None
     filename = "untitled" if title is None else dated_file_title.replace(
         " ", "_").lower()
 
-    if pdf is not None:
-        pdf.savefig(fig)
-    else:
-        fig.savefig(filename + ".pdf", format="pdf")
-    fig.clf()
+    with span("plot.savefig"):
+        if pdf is not None:
+            pdf.savefig(fig)
+        else:
+            fig.savefig(filename + ".pdf", format="pdf")
 
 
 def render_ax(ax: plt.Axes, xl=None, yl=None, title=""):
@@ -56,10 +207,16 @@ def render_ax(ax: plt.Axes, xl=None, yl=None, title=""):
 
 
 def plot_cash_flow(ax_flow: plt.Axes, ax_cumulative: plt.Axes, account: Account, dates, period: int = 1):
-    balance = sample(dates, account.balance())
-    gain = aggregate(dates, account.gain())
-    loss = aggregate(dates, account.loss())
+    index = account.range_index()
+    plot_flows(ax_flow, ax_cumulative, dates,
+               index.balance_series(dates),
+               index.gain_series(dates),
+               index.loss_series(dates),
+               period=period)
+
 
+@timed("plot.cash_flow")
+def plot_flows(ax_flow: plt.Axes, ax_cumulative: plt.Axes, dates, balance, gain, loss, period: int = 1):
     rng_min = round(period/2)
     rng_max = len(dates) - rng_min
     smoothed_balance = smooth(period, balance)[rng_min:rng_max]
@@ -85,7 +242,7 @@ def plot_cash_flow(ax_flow: plt.Axes, ax_cumulative: plt.Axes, account: Account,
 
     cumulated_gain = cumulate(gain)
     cumulated_loss = cumulate(loss)
-    cumulated_pnl = [x - y for x, y in zip(cumulated_gain, cumulated_loss)]
+    cumulated_pnl = cumulated_gain - cumulated_loss
 
     smoothed_cumulated_gain = smooth(period, cumulated_gain)[rng_min:rng_max]
     smoothed_cumulated_loss = smooth(period, cumulated_loss)[rng_min:rng_max]
@@ -109,11 +266,10 @@ def plot_cash_flow(ax_flow: plt.Axes, ax_cumulative: plt.Axes, account: Account,
     render_ax(ax_cumulative, title="Profit & Loss")
 
 
-def plot_repartition(ax_pos: plt.Axes, ax_neg: plt.Axes, amount_by_category, dates, title="Repartition", period=1):
-    cumulated = list(map(lambda v: (v[0], cumulate(
-        aggregate(dates, v[1]))), amount_by_category.items()))
-    positive = list(filter(lambda y: max(y[1]) > 0, cumulated))
-    negative = list(filter(lambda y: max(y[1]) <= 0, cumulated))
+@timed("plot.repartition")
+def plot_repartition(ax_pos: plt.Axes, ax_neg: plt.Axes, bundle: SeriesBundle, dates, title="Repartition", period=1):
+    positive = bundle.positive
+    negative = bundle.negative
 
     ax_pos.xaxis.set_major_formatter(mdates.DateFormatter("%b %d"))
     ax_neg.xaxis.set_major_formatter(mdates.DateFormatter("%b %d"))
@@ -141,15 +297,14 @@ def plot_repartition(ax_pos: plt.Axes, ax_neg: plt.Axes, amount_by_category, dat
         render_ax(ax_pos)
 
 
-def plot_pie_repartition(ax: plt.Axes, amount_by_category, dates):
-    cumulated = list(map(lambda v: (v[0], cumulate(
-        aggregate(dates, v[1]))), amount_by_category.items()))
-
-    positive = list(filter(lambda y: max(y[1]) > 0, cumulated))
+@timed("plot.pie_repartition")
+def plot_pie_repartition(ax: plt.Axes, bundle: SeriesBundle):
+    # A series can go above zero and still end the period below it
+    positive = [y for y in bundle.positive if y[1][-1] >= 0]
     positive_labels = list(map(lambda y: y[0], positive))
     positive_values = list(map(lambda y: y[1][-1], positive))
 
-    negative = list(filter(lambda y: max(y[1]) <= 0, cumulated))
+    negative = bundle.negative
     negative_labels = list(map(lambda y: y[0], negative))
     negative_values = list(map(lambda y: -y[1][-1], negative))
 
@@ -171,15 +326,13 @@ def plot_pie_repartition(ax: plt.Axes, amount_by_category, dates):
         render_ax(ax)
 
 
-def plot_bar_repartition(ax: plt.Axes, amount_by_category, dates):
-    cumulated = list(map(lambda v: (v[0], cumulate(
-        aggregate(dates, v[1]))), amount_by_category.items()))
-
-    positive = list(filter(lambda y: max(y[1]) > 0, cumulated))
+@timed("plot.bar_repartition")
+def plot_bar_repartition(ax: plt.Axes, bundle: SeriesBundle):
+    positive = bundle.positive
     positive_labels = list(map(lambda y: y[0], positive))
     positive_values = list(map(lambda y: y[1][-1], positive))
 
-    negative = list(filter(lambda y: max(y[1]) <= 0, cumulated))
+    negative = bundle.negative
     negative_labels = list(map(lambda y: y[0], negative))
     negative_values = list(map(lambda y: -y[1][-1], negative))
 
@@ -199,38 +352,308 @@ def plot_bar_repartition(ax: plt.Axes, amount_by_category, dates):
     ax.set_xticks([])
 
 
-def render_synthesis(export_account, dates, period=1):
+def period_label(date: datetime.date, granularity):
+    if granularity == "quarter":
+        return f"Q{(date.month - 1) // 3 + 1} {date.year}"
+    if granularity == "year":
+        return date.strftime("%Y")
+    if granularity == "month":
+        return date.strftime("%b %Y")
+    return date.strftime("%b %d")
+
+
+@timed("plot.period_totals")
+def plot_period_totals(ax: plt.Axes, starts, totals, granularity):
+    x = np.arange(len(starts))
+    width = 0.4
+    gain = totals["gain"]
+    loss = totals["loss"]
+
+    ax.yaxis.set_major_formatter('{x} €')
+    ax.bar(x - width / 2, gain, width, color="green", label="Profit")
+    ax.bar(x + width / 2, loss, width, color="red", label="Loss")
+    ax.plot(x, gain - loss, "o-", color="black", label="P&L")
+    ax.set_xticks(x, [period_label(d, granularity) for d in starts])
+
+    render_ax(ax, title=f"Profit & Loss ~ {granularity.capitalize()}")
+
+
+def render_totals(pdf, rollup: PeriodRollup, totals, start, end, on_page):
+    pages = page_templates()
+    fig, ax = pages.overall, pages.overall_axes
+    with span("plot.figure"):
+        for a in ax:
+            reset_ax(a, dates=False)
+    for a, granularity in zip(ax, totals):
+        plot_period_totals(a, *rollup.totals(granularity, start, end),
+                           granularity)
+
+    render_fig(fig, title="Period totals", pdf=pdf)
+    on_page()
+
+
+@timed("plot.account_breakdown")
+def plot_account_breakdown(ax_balance: plt.Axes, ax_pos: plt.Axes, ax_neg: plt.Axes, series: PortfolioSeries, period=1):
+    dates = series.total.dates
+    rng_min = round(period/2)
+    rng_max = len(dates) - rng_min
+    smoothed_dates = dates[rng_min:rng_max]
+
+    ax_balance.yaxis.set_major_formatter("{x} €")
+    ax_balance.xaxis.set_major_formatter(mdates.DateFormatter("%b %d"))
+
+    for name, account_series in series.accounts.items():
+        smoothed_balance = smooth(period, account_series.balance)[rng_min:rng_max]
+        ax_balance.plot(smoothed_dates, smoothed_balance, label=name)
+        ax_balance.text(smoothed_dates[-1], smoothed_balance[-1],
+                        f"{round(smoothed_balance[-1])} €", fontweight="bold")
+
+    render_ax(ax_balance, title="Balance ~ Accounts")
+
+    flows = SeriesBundle(dates, {name: s.gain - s.loss
+                                 for name, s in series.accounts.items()})
+    plot_repartition(ax_pos, ax_neg, flows, dates,
+                     title="Accounts", period=period)
+
+
+@timed("plot.render_synthesis")
+def render_synthesis(export_account, dates, period=1, directory=".", on_page=None, totals=(), name=None):
     start = dates[0]
     end = dates[-1]
+    on_page = on_page if on_page is not None else lambda: None
 
-    with PdfPages(f"{start.isoformat()}_{end.isoformat()}_{1}_days_account_synthesis.pdf") as pdf:
-        fig, ax = plt.subplots(4, 1, sharex=True)
+    pages = page_templates()
+
+    with PdfPages(os.path.join(directory, synthesis_filename(start, end, name))) as pdf:
+        fig, ax = pages.synthesis, pages.synthesis_axes
+        with span("plot.figure"):
+            for a in ax:
+                reset_ax(a)
 
         plot_cash_flow(ax[0], ax[1], export_account, dates, period=period)
 
-        amount_by_category = export_account.by_category()
-        amount_by_sub_category = export_account.by_sub_category()
-        plot_repartition(ax[2], ax[3], amount_by_category,
-                         dates, period=period)
+        index = export_account.category_index()
+        categories = SeriesBundle.from_index(index, dates)
+        plot_repartition(ax[2], ax[3], categories, dates, period=period)
 
         render_fig(fig, title="Account synthesis", date=end, pdf=pdf)
-        plt.close(fig)
+        on_page()
+
+        if len(totals) > 0:
+            render_totals(pdf, export_account.rollup(), totals, start, end, on_page)
 
-        fig, ax = plt.subplots(2, 1)
-        plot_pie_repartition(ax[0], amount_by_category, dates)
-        plot_bar_repartition(ax[1], amount_by_category, dates)
+        fig, ax = pages.overall, pages.overall_axes
+        with span("plot.figure"):
+            for a in ax:
+                reset_ax(a, dates=False)
+        plot_pie_repartition(ax[0], categories)
+        plot_bar_repartition(ax[1], categories)
 
         render_fig(fig, title="Overall repartition", pdf=pdf)
+        on_page()
+
+        for category in index.groups:
+            sub_categories = SeriesBundle.from_index(index, dates, category)
+            fig, ax = pages.detail, pages.detail_axes
+            with span("plot.figure"):
+                reset_ax(ax[0], dates=False)
+                reset_ax(ax[1], dates=False)
+                reset_ax(ax[2])
+            plot_pie_repartition(ax[0], sub_categories)
+            plot_bar_repartition(ax[1], sub_categories)
+            plot_repartition(ax[2], ax[2], sub_categories,
+                             dates, period=period)
+
+            render_fig(
+                fig, title=f"Detailed Repartition ~ {category}", pdf=pdf)
+            on_page()
+
+
+@timed("plot.render_portfolio")
+def render_portfolio(series: PortfolioSeries, period=1, directory=".", on_page=None, totals=(), rollup=None):
+    total = series.total
+    dates = total.dates
+    on_page = on_page if on_page is not None else lambda: None
+
+    pages = page_templates()
 
-        plt.close(fig)
+    with PdfPages(os.path.join(directory, portfolio_filename(dates[0], dates[-1]))) as pdf:
+        fig, ax = pages.synthesis, pages.synthesis_axes
+        with span("plot.figure"):
+            for a in ax:
+                reset_ax(a)
 
-        for category, amounts in amount_by_sub_category.items():
-            fig, ax = plt.subplots(3, 1)
-            plot_pie_repartition(ax[0], amounts, dates)
-            plot_bar_repartition(ax[1], amounts, dates)
-            plot_repartition(ax[2], ax[2], amounts, dates, period=period)
+        plot_flows(ax[0], ax[1], dates, total.balance, total.gain, total.loss,
+                   period=period)
+
+        categories = SeriesBundle.from_series(total)
+        plot_repartition(ax[2], ax[3], categories, dates, period=period)
+
+        render_fig(fig, title="Portfolio synthesis", date=dates[-1], pdf=pdf)
+        on_page()
+
+        if len(totals) > 0:
+            render_totals(pdf, rollup, totals, dates[0], dates[-1], on_page)
+
+        fig, ax = pages.breakdown, pages.breakdown_axes
+        with span("plot.figure"):
+            for a in ax:
+                reset_ax(a)
+        plot_account_breakdown(ax[0], ax[1], ax[2], series, period=period)
+
+        render_fig(fig, title="Accounts breakdown", pdf=pdf)
+        on_page()
+
+        fig, ax = pages.overall, pages.overall_axes
+        with span("plot.figure"):
+            for a in ax:
+                reset_ax(a, dates=False)
+        plot_pie_repartition(ax[0], categories)
+        plot_bar_repartition(ax[1], categories)
+
+        render_fig(fig, title="Overall repartition", pdf=pdf)
+        on_page()
+
+        for category in total.categories:
+            sub_categories = SeriesBundle.from_series(total, category)
+            fig, ax = pages.detail, pages.detail_axes
+            with span("plot.figure"):
+                reset_ax(ax[0], dates=False)
+                reset_ax(ax[1], dates=False)
+                reset_ax(ax[2])
+            plot_pie_repartition(ax[0], sub_categories)
+            plot_bar_repartition(ax[1], sub_categories)
+            plot_repartition(ax[2], ax[2], sub_categories,
+                             dates, period=period)
 
             render_fig(
                 fig, title=f"Detailed Repartition ~ {category}", pdf=pdf)
-
-            plt.close(fig)
+            on_page()
+
+
+def render_period(account: Account, start, end, period, granularity=None, directory=".", on_page=None, name=None):
+    render_synthesis(account, make_linear_date(start, end),
+                     period=period, directory=directory, on_page=on_page,
+                     totals=REPORT_TOTALS.get(granularity, ()), name=name)
+    return end
+
+
+def init_worker(timings=False):
+    matplotlib.use("agg")
+    if timings:
+        timing.enable()
+
+
+def render_job(account: Account, start, end, period, granularity, directory=".", name=None):
+    render_period(account, start, end, period, granularity, directory, name=name)
+    return timing.collect()
+
+
+def synthesis_jobs(account: Account, only_last_month=False):
+    end_date = account.ended_at()
+    start_date = account.started_at()
+    jobs = [(start_date, end_date, 30, None)]
+
+    for granularity in ("month",) if only_last_month else REPORT_PERIODS:
+        scale = make_period_dates(start_date, end_date, granularity)
+        periods = list(zip(scale, scale[1:]))
+        if only_last_month:
+            periods = periods[-1:]
+        jobs += [(start, end, REPORT_PERIODS[granularity], granularity)
+                 for start, end in periods]
+    return jobs
+
+
+def synthesis_pages(account: Account, granularity=None):
+    pages = 2 + len(account.category_index().groups)
+    return pages + 1 if granularity in REPORT_TOTALS else pages
+
+
+def synthetize(account: Account, only_last_month=False, workers=1, directory=".", on_progress=None, name=None):
+    all_jobs = synthesis_jobs(account, only_last_month)
+    on_progress = on_progress if on_progress is not None else lambda *_: None
+    pages = {granularity: synthesis_pages(account, granularity)
+             for *_, granularity in all_jobs}
+    total = sum(pages[granularity] for *_, granularity in all_jobs)
+    done = 0
+
+    def on_page():
+        nonlocal done
+        done += 1
+        on_progress(done, total)
+
+    cache = RenderCache(directory, name)
+    jobs = {}
+    for start, end, period, granularity in all_jobs:
+        filename = synthesis_filename(start, end, name)
+        fingerprint = account.fingerprint(start, end, period)
+        if cache.is_fresh(filename, fingerprint):
+            done += pages[granularity]
+            on_progress(done, total)
+        else:
+            jobs[(start, end, period, granularity)] = (filename, fingerprint)
+
+    if workers <= 1:
+        for job, (filename, fingerprint) in jobs.items():
+            render_period(account, *job, directory=directory, on_page=on_page, name=name)
+            cache.update(filename, fingerprint)
+    else:
+        snapshot = account.snapshot()
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_worker,
+                                 initargs=(timing.is_enabled(),)) as executor:
+            futures = {executor.submit(render_job, snapshot, *job, directory, name): job
+                       for job in jobs}
+            try:
+                for future in as_completed(futures):
+                    timing.merge(future.result())
+                    job = futures[future]
+                    cache.update(*jobs[job])
+                    done += pages[job[3]]
+                    on_progress(done, total)
+            except BaseException:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    return [os.path.join(directory, filename) for filename, _ in jobs.values()]
+
+
+def synthetize_portfolio(portfolio: Portfolio, only_last_month=False, workers=1, directory=".", on_progress=None):
+    all_jobs = synthesis_jobs(portfolio, only_last_month)
+    on_progress = on_progress if on_progress is not None else lambda *_: None
+
+    cache = RenderCache(directory)
+    jobs = {}
+    for start, end, period, granularity in all_jobs:
+        filename = portfolio_filename(start, end)
+        fingerprint = portfolio.fingerprint(start, end, period)
+        if not cache.is_fresh(filename, fingerprint):
+            jobs[(start, end, period, granularity)] = (filename, fingerprint)
+
+    if len(jobs) == 0:
+        on_progress(1, 1)
+        return []
+
+    dates = make_linear_date(min(start for start, *_ in jobs),
+                             max(end for _, end, *_ in jobs))
+    series = portfolio.aggregate(dates, workers)
+    rollup = PeriodRollup.from_series(dates, {"gain": series.total.gain,
+                                              "loss": series.total.loss})
+    pages = 3 + len(series.total.categories)
+    total = sum(pages + (granularity in REPORT_TOTALS) for *_, granularity in jobs)
+    done = 0
+
+    def on_page():
+        nonlocal done
+        done += 1
+        on_progress(done, total)
+
+    for job, (filename, fingerprint) in jobs.items():
+        (start, end, period, granularity) = job
+        render_portfolio(series.slice(start, end), period,
+                         directory=directory, on_page=on_page,
+                         totals=REPORT_TOTALS.get(granularity, ()),
+                         rollup=rollup)
+        cache.update(filename, fingerprint)
+
+    return [os.path.join(directory, filename) for filename, _ in jobs.values()]
@@ -0,0 +1,209 @@
+import os
+import re
+from collections import deque
+
+import numpy as np
+
+from core import *
+from timing import timed
+
+RULES_FILENAME = "rules.csv"
+RULES_HEADER = ["Type", "Motif", "Minimum", "Maximum",
+                "Categorie", "Sous categorie"]
+
+
+def parse_bound(value):
+    value = value.strip()
+    return None if value == "" else float(value.replace(",", "."))
+
+
+class Rule:
+    kind: str
+    pattern: str
+    minimum: float | None
+    maximum: float | None
+    category: str
+    sub_category: str
+    regex: re.Pattern | None
+
+    def __init__(self, kind, pattern, minimum, maximum, category, sub_category):
+        if kind not in ("contains", "regex"):
+            raise ValueError(f"Unknown rule type {kind}")
+        self.kind = kind
+        self.pattern = pattern
+        self.minimum = minimum
+        self.maximum = maximum
+        self.category = category
+        self.sub_category = sub_category
+        self.regex = re.compile(pattern, re.IGNORECASE | re.DOTALL) \
+            if kind == "regex" else None
+
+    def is_standalone(self):
+        # Joined with the other rules, the pattern's groups are renumbered,
+        # which breaks its backreferences and named groups
+        if self.regex.groups > 0:
+            return True
+        try:
+            re.compile(f"(?:(?=.*?(?P<r0>{self.pattern})))?")
+        except re.error:
+            return True
+        return False
+
+    def accepts(self, amounts):
+        accepted = np.ones(len(amounts), dtype=bool)
+        if self.minimum is not None:
+            accepted &= amounts >= self.minimum
+        if self.maximum is not None:
+            accepted &= amounts <= self.maximum
+        return accepted
+
+    @ staticmethod
+    def parse(row):
+        return Rule(row[0].strip().lower(), row[1],
+                    parse_bound(row[2]), parse_bound(row[3]),
+                    row[4], row[5])
+
+
+class Automaton:
+    goto: list[dict[str, int]]
+    fail: list[int]
+    outputs: list[tuple[int, ...]]
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        outputs = [[]]
+        for pattern, value in patterns:
+            state = 0
+            for char in pattern:
+                child = self.goto[state].get(char)
+                if child is None:
+                    child = self.goto[state][char] = len(self.goto)
+                    self.goto.append({})
+                    outputs.append([])
+                state = child
+            outputs[state].append(value)
+
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fail = self.fail[state]
+                while fail != 0 and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                outputs[child] += outputs[self.fail[child]]
+
+        self.outputs = [tuple(sorted(set(o))) for o in outputs]
+
+    def search(self, text):
+        goto = self.goto
+        fail = self.fail
+        outputs = self.outputs
+
+        state = 0
+        found = set(outputs[0])
+        for char in text:
+            while state != 0 and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return found
+
+
+class Categorizer:
+    rules: list[Rule]
+    automaton: Automaton
+    regex: re.Pattern | None
+    prefilter: re.Pattern | None
+    standalone: list[tuple[int, re.Pattern]]
+    memo: dict[str, tuple[int, ...]]
+
+    def __init__(self, rules: list[Rule]):
+        self.rules = rules
+        self.automaton = Automaton([(rule.pattern.casefold(), idx)
+                                    for idx, rule in enumerate(rules)
+                                    if rule.kind == "contains"])
+
+        # Every regex rule is an optional lookahead of a single pattern, the
+        # groups that took part in the match are the rules matching the label.
+        # Most labels match none of them, which a plain alternation tells faster
+        patterns = [(idx, rule.pattern) for idx, rule in enumerate(rules)
+                    if rule.kind == "regex" and not rule.is_standalone()]
+        self.standalone = [(idx, rule.regex) for idx, rule in enumerate(rules)
+                           if rule.kind == "regex" and rule.is_standalone()]
+        self.regex = None
+        self.prefilter = None
+        if len(patterns) > 0:
+            self.regex = re.compile("".join(f"(?:(?=.*?(?P<r{idx}>{pattern})))?"
+                                            for idx, pattern in patterns),
+                                    re.IGNORECASE | re.DOTALL)
+            self.prefilter = re.compile("|".join(f"(?:{pattern})" for _, pattern in patterns),
+                                        re.IGNORECASE | re.DOTALL)
+        self.memo = {}
+
+    @ staticmethod
+    def read(filepath):
+        rules = []
+        for line, row in enumerate(read_csv_file(filepath), start=1):
+            if (line == 1 and row == RULES_HEADER) or len(row) < 6:
+                continue
+            try:
+                rules.append(Rule.parse(row))
+            except (re.error, ValueError) as e:
+                raise ValueError(f"{filepath} line {line}: invalid rule, {e}") from e
+        return Categorizer(rules)
+
+    @ staticmethod
+    def find(directory):
+        filepath = os.path.join(directory, RULES_FILENAME)
+        return Categorizer.read(filepath) if os.path.exists(filepath) else None
+
+    def matches(self, label):
+        try:
+            return self.memo[label]
+        except KeyError:
+            pass
+
+        found = self.automaton.search(label.casefold())
+        if self.regex is not None and self.prefilter.search(label) is not None:
+            groups = self.regex.match(label).groupdict()
+            found.update(int(name[1:]) for name, value in groups.items()
+                         if name[0] == "r" and name[1:].isdigit() and value is not None)
+        found.update(idx for idx, regex in self.standalone
+                     if regex.search(label) is not None)
+        matches = self.memo[label] = tuple(sorted(found))
+        return matches
+
+    @timed("rules.categorize")
+    def categorize(self, table: TransactionTable):
+        labels_by_rule = {}
+        for code, label in enumerate(table.labels):
+            for idx in self.matches(label):
+                labels_by_rule.setdefault(idx, []).append(code)
+        if len(labels_by_rule) == 0:
+            return table
+
+        category = table.category.copy()
+        sub_category = table.sub_category.copy()
+        category_codes = {v: i for i, v in enumerate(table.categories)}
+        sub_category_codes = {v: i for i, v in enumerate(table.sub_categories)}
+        assigned = np.zeros(len(table), dtype=bool)
+
+        # Rules are applied in file order, the first accepted rule wins
+        for idx in sorted(labels_by_rule):
+            rule = self.rules[idx]
+            labels = np.zeros(len(table.labels), dtype=bool)
+            labels[labels_by_rule[idx]] = True
+            rows = labels[table.label] & ~assigned & rule.accepts(table.amount)
+            category[rows] = category_codes.setdefault(rule.category,
+                                                       len(category_codes))
+            sub_category[rows] = sub_category_codes.setdefault(rule.sub_category,
+                                                               len(sub_category_codes))
+            assigned |= rows
+
+        return TransactionTable(table.occured_at, table.amount, category, sub_category,
+                                table.label, list(category_codes),
+                                list(sub_category_codes), table.labels)
@@ -0,0 +1,50 @@
+import datetime
+import os
+
+import pytest
+
+from core import Account, Journal, Transaction, write_csv_file
+
+
+def transaction(day, label="CAFE"):
+    return Transaction(datetime.date(2024, 1, 1) + datetime.timedelta(days=day),
+                       "", "", label, -2.5)
+
+
+@pytest.fixture
+def journaled(tmp_path):
+    filepath = str(tmp_path / "current.csv")
+    current = Account(100.0, transaction(9).occured_at,
+                      [transaction(day) for day in range(10)])
+    current.write_current(filepath)
+    current = Account.read_current(filepath)
+    merged = current.merge(Account(100.0, transaction(12).occured_at,
+                                   [transaction(9), transaction(10), transaction(11)]))
+    merged.append_current(filepath, current)
+    assert Journal(filepath).exists()
+    return filepath
+
+
+def test_compaction_interrupted_before_replacing_the_record(journaled):
+    Journal(journaled).set_aside()
+
+    assert len(Account.read_current(journaled).table) == 12
+    assert Journal(journaled).exists()
+
+
+def test_compaction_interrupted_after_replacing_the_record(journaled):
+    journal = Journal(journaled)
+    account = Account.read_current(journaled)
+    journal.set_aside()
+    write_csv_file(journaled, account.to_export())
+
+    assert len(Account.read_current(journaled).table) == 12
+    assert not journal.exists()
+    assert not os.path.exists(journal.compacting_filepath)
+
+
+def test_compaction_folds_the_journal(journaled):
+    Journal(journaled).compact()
+
+    assert not Journal(journaled).exists()
+    assert len(Account.read_current(journaled).table) == 12
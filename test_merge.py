@@ -0,0 +1,63 @@
+import datetime
+import random
+from collections import Counter
+
+import pytest
+
+from core import Account, Transaction, make_french_date
+from duplicates import DuplicateMatcher
+
+
+def coffee(day, label="CB CAFE DU COIN"):
+    occured_at = datetime.date(2024, 1, 1) + datetime.timedelta(days=day)
+    return Transaction(occured_at, "", "", f"{label} {make_french_date(occured_at, '/')[:5]}", -2.5)
+
+
+def merge(current, transactions, matcher=None):
+    imported = Account(0.0, coffee(32).occured_at, transactions)
+    return current.merge(imported, matcher)
+
+
+# Recurring same-amount purchases at an import boundary are distinct
+# transactions, only a rebooking inside the import's coverage is a duplicate
+@pytest.mark.parametrize("transactions, expected, expected_matches", [
+    ([coffee(30), coffee(31)], 4, 0),
+    ([coffee(29), coffee(30)], 3, 0),
+    ([coffee(28), coffee(31, "CARTE 4512 CAFE DU COIN")], 2, 1),
+], ids=["disjoint import", "overlapping import", "rebooked transaction"])
+def test_fuzzy_merge_boundary(transactions, expected, expected_matches):
+    current = Account(0.0, coffee(29).occured_at, [coffee(28), coffee(29)])
+    matcher = DuplicateMatcher()
+
+    merged = merge(current, transactions, matcher)
+
+    assert len(merged.transactions) == expected
+    assert len(matcher.matches) == expected_matches
+
+
+def test_merge_keeps_identical_transactions_of_the_last_day():
+    rent = Transaction(coffee(28).occured_at, "", "", "RENT", -800.0)
+    current = Account(0.0, coffee(29).occured_at, [rent, coffee(29)])
+
+    merged = merge(current, [coffee(29), coffee(29)])
+
+    assert [t.label for t in merged.transactions] == \
+        ["RENT", coffee(29).label, coffee(29).label]
+
+
+def test_merge_keeps_most_copies_of_each_transaction():
+    rng = random.Random(0)
+    for _ in range(300):
+        current = sorted((coffee(rng.randrange(4), rng.choice("AB"))
+                          for _ in range(rng.randrange(1, 6))), key=Transaction.key)
+        imported = sorted((coffee(rng.randrange(2, 6), rng.choice("AB"))
+                           for _ in range(rng.randrange(1, 6))), key=Transaction.key)
+        last_occured_at = current[-1].occured_at
+
+        merged = merge(Account(0.0, coffee(1).occured_at, current), imported)
+
+        self_keys = Counter(map(Transaction.key, current))
+        other_keys = Counter(map(Transaction.key, imported))
+        expected = self_keys | Counter({key: count for key, count in other_keys.items()
+                                        if key in self_keys or key[0] > last_occured_at})
+        assert Counter(map(Transaction.key, merged.transactions)) == expected
@@ -0,0 +1,41 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from core import make_year_days, PeriodRollup
+
+
+@pytest.fixture
+def rollup():
+    days = make_year_days(datetime.date(2025, 1, 1), datetime.date(2025, 12, 31))
+    rng = np.random.default_rng(0)
+    return PeriodRollup(days, {"gain": rng.uniform(0, 10, len(days)),
+                               "loss": rng.uniform(0, 10, len(days))})
+
+
+def test_totals_stay_within_the_window(rollup):
+    start = datetime.date(2025, 1, 1)
+    end = datetime.date(2025, 4, 1)
+    days = rollup.levels["day"][0]
+    inside = (days >= np.datetime64(start)) & (days < np.datetime64(end))
+
+    for granularity in ("week", "month", "quarter"):
+        (_, totals) = rollup.totals(granularity, start, end)
+        for name, values in rollup.levels["day"][1].items():
+            assert totals[name].sum() == pytest.approx(values[inside].sum())
+
+
+def test_week_totals_ignore_days_after_the_window(rollup):
+    start = datetime.date(2025, 1, 1)
+    end = datetime.date(2025, 4, 1)
+    (starts, before) = rollup.totals("week", start, end)
+
+    rollup.levels["day"][1]["loss"][(datetime.date(2025, 4, 3) - start).days] += 100.0
+    rollup.prefixes.clear()
+    rollup.levels = {"day": rollup.levels["day"]}
+    (_, after) = rollup.totals("week", start, end)
+
+    assert starts[0] == datetime.date(2024, 12, 30)
+    assert starts[-1] == datetime.date(2025, 3, 31)
+    np.testing.assert_array_equal(before["loss"], after["loss"])
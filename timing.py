@@ -0,0 +1,103 @@
+import cProfile
+import contextlib
+import functools
+import time
+
+_enabled = False
+_stats: dict[str, list] = {}
+_null_span = contextlib.nullcontext()
+
+
+class _Span:
+    name: str
+    wall: float
+    cpu: float
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *_):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        try:
+            stat = _stats[self.name]
+        except KeyError:
+            stat = _stats[self.name] = [0, 0.0, 0.0]
+        stat[0] += 1
+        stat[1] += wall
+        stat[2] += cpu
+        return False
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def span(name):
+    if not _enabled:
+        return _null_span
+    return _Span(name)
+
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report():
+    return {name: {"count": count, "wall": wall, "cpu": cpu}
+            for name, (count, wall, cpu) in sorted(_stats.items())}
+
+
+def collect():
+    stats = report()
+    _stats.clear()
+    return stats
+
+
+def merge(stats):
+    for name, stat in stats.items():
+        try:
+            current = _stats[name]
+        except KeyError:
+            current = _stats[name] = [0, 0.0, 0.0]
+        current[0] += stat["count"]
+        current[1] += stat["wall"]
+        current[2] += stat["cpu"]
+
+
+@contextlib.contextmanager
+def profile(filepath=None):
+    if filepath is None:
+        yield None
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filepath)